@@ -0,0 +1,154 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\combat.py
+# The combat rules, without any I/O, shared by the game and the combat simulator (combat_sim.py).
+# One round: the player attacks, uses a special move or deflects. If the NPC is still standing it strikes back,
+# for half its attack power (rounded down) if the player deflected, and the player's special move cooldowns
+# tick down by one. The game prints its messages around these functions; fight() plays out a whole fight for
+# the simulator, with the player's choices made by a FightPolicy from a seeded random stream.
+ACTION_ATTACK = "attack"
+ACTION_SPECIAL = "special"
+ACTION_DEFLECT = "deflect"
+OUTCOME_WON = "won"
+OUTCOME_LOST = "lost"
+OUTCOME_TIMEOUT = "timeout" # Neither side fell within max_rounds (e.g. an NPC with no attack power)
+DEFAULT_MAX_ROUNDS = 100
+
+_MASK64 = (1 << 64) - 1
+_FIGHT_KEY_MULTIPLIER = 0x100000001B3
+
+
+# --- Rules ---
+def attack_damage(attack_power):
+    return attack_power
+
+
+def special_move_damage(attack_power, move):
+    """Damage of a special move: its fixed "damage" if it has one (e.g. Fireball), else attack power x damage_multiplier."""
+    if "damage" in move:
+        return move["damage"]
+    return int(attack_power * move.get("damage_multiplier", 1))
+
+
+def special_move_ready(cooldowns, move_id):
+    return cooldowns.get(move_id, 0) == 0
+
+
+def start_cooldown(cooldowns, move_id, move):
+    cooldowns[move_id] = move.get("cooldown_max", 0)
+
+
+def tick_cooldowns(cooldowns):
+    """End of round: every special move on cooldown gets one turn closer to ready. Changes cooldowns in place."""
+    for move_id, turns_left in cooldowns.items():
+        if turns_left > 0:
+            cooldowns[move_id] = turns_left - 1
+
+
+def npc_attack_damage(npc_attack_power, player_deflecting):
+    if player_deflecting:
+        return max(0, npc_attack_power // 2)
+    return npc_attack_power
+
+
+def apply_damage(hp, damage):
+    """HP left after taking damage; never below 0."""
+    return max(0, hp - damage)
+
+
+# --- Seeded random stream for simulated fights ---
+def splitmix64(value):
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+def fight_key(seed, fight_index):
+    return splitmix64((seed * _FIGHT_KEY_MULTIPLIER + fight_index) & _MASK64)
+
+
+def turn_draw(key, round_number):
+    """A uniform number in [0, 1) for one round of the fight with this fight_key().
+
+    It depends only on (seed, fight index, round), not on what was drawn before, so every engine (see
+    combat_numpy.py), process and batch split plays exactly the same fights from the same seed.
+    """
+    return (splitmix64((key + round_number) & _MASK64) >> 11) * (1.0 / (1 << 53))
+
+
+# --- Whole fights ---
+class FightPolicy:
+    """How a simulated player picks actions. Each round, with probability deflect_chance they deflect;
+    otherwise, with probability special_chance, they use their strongest special move that is ready; else they attack."""
+
+    def __init__(self, deflect_chance=0.0, special_chance=1.0):
+        if not (0.0 <= deflect_chance <= 1.0 and 0.0 <= special_chance <= 1.0):
+            raise ValueError("deflect_chance and special_chance must be between 0 and 1.")
+        self.deflect_chance = deflect_chance
+        self.special_chance = special_chance
+
+    @property
+    def special_threshold(self):
+        """Draws below this (and not below deflect_chance) use a special move."""
+        return self.deflect_chance + (1.0 - self.deflect_chance) * self.special_chance
+
+    def choose(self, draw, special_ready):
+        if draw < self.deflect_chance:
+            return ACTION_DEFLECT
+        if special_ready and draw < self.special_threshold:
+            return ACTION_SPECIAL
+        return ACTION_ATTACK
+
+    def to_dict(self):
+        return {"deflect_chance": self.deflect_chance, "special_chance": self.special_chance}
+
+
+def moves_by_damage(player_stats):
+    """[(move_id, move, damage)] of the player's special moves, strongest first (ties by move id)."""
+    moves = [(move_id, move, special_move_damage(player_stats["attack_power"], move))
+             for move_id, move in player_stats.get("special_moves", {}).items()]
+    moves.sort(key=lambda entry: (-entry[2], entry[0]))
+    return moves
+
+
+class FightResult:
+    def __init__(self, outcome, rounds, player_hp, npc_hp, hp_curve):
+        self.outcome = outcome
+        self.rounds = rounds
+        self.player_hp = player_hp
+        self.npc_hp = npc_hp
+        self.hp_curve = hp_curve # Player HP at the end of each round
+
+
+def fight(player_stats, npc_stats, policy, seed, fight_index, max_rounds=DEFAULT_MAX_ROUNDS):
+    """Plays one fight to the end. player_stats: {"hp", "attack_power", "special_moves"}; npc_stats: {"hp", "attack_power"}."""
+    player_hp = player_stats["hp"]
+    npc_hp = npc_stats["hp"]
+    moves = moves_by_damage(player_stats)
+    cooldowns = {move_id: 0 for move_id, _move, _damage in moves}
+    deflecting = False
+    hp_curve = []
+    key = fight_key(seed, fight_index)
+
+    for round_number in range(1, max_rounds + 1):
+        ready_move = next((entry for entry in moves if special_move_ready(cooldowns, entry[0])), None)
+        action = policy.choose(turn_draw(key, round_number), ready_move is not None)
+        if action == ACTION_ATTACK:
+            npc_hp = apply_damage(npc_hp, attack_damage(player_stats["attack_power"]))
+        elif action == ACTION_SPECIAL:
+            move_id, move, damage = ready_move
+            npc_hp = apply_damage(npc_hp, damage)
+            start_cooldown(cooldowns, move_id, move)
+        else:
+            deflecting = True
+
+        if npc_hp <= 0:
+            hp_curve.append(player_hp)
+            return FightResult(OUTCOME_WON, round_number, player_hp, npc_hp, hp_curve)
+
+        player_hp = apply_damage(player_hp, npc_attack_damage(npc_stats["attack_power"], deflecting))
+        deflecting = False # A deflect only lasts until the next blow
+        hp_curve.append(player_hp)
+        if player_hp <= 0:
+            return FightResult(OUTCOME_LOST, round_number, player_hp, npc_hp, hp_curve)
+        tick_cooldowns(cooldowns)
+    return FightResult(OUTCOME_TIMEOUT, max_rounds, player_hp, npc_hp, hp_curve)
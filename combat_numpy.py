@@ -0,0 +1,105 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\combat_numpy.py
+# Vectorized version of combat.fight() for the combat simulator (combat_sim.py --backend numpy).
+# A batch of fights between the same player preset and NPC is held as arrays (player HP, NPC HP, a cooldown
+# per special move) and every fight still going is advanced one round at a time with array operations.
+# The random draws use the same splitmix64 stream as combat.turn_draw(), computed on uint64 arrays, so a batch
+# plays exactly the fights the Python engine would play from the same seed, only much faster.
+# NumPy is optional (pip install numpy); numpy_available tells whether this backend can be used.
+from collections import Counter
+
+import combat
+
+try:
+    import numpy as np
+    numpy_available = True
+except ImportError:
+    np = None
+    numpy_available = False
+
+
+class BatchTotals:
+    """What a batch of fights adds up to; combat_sim.MatchupStats takes these over."""
+
+    def __init__(self):
+        self.outcomes = Counter()
+        self.time_to_kill = Counter() # Rounds needed -> number of won fights
+        self.won_hp_sum = 0
+        self.hp_sums = []             # Round - 1 -> sum of player HP at the end of that round
+        self.hp_counts = []           # Round - 1 -> number of fights that reached that round
+
+
+def _splitmix64(values):
+    """combat.splitmix64 for a uint64 array. uint64 arithmetic wraps around, which does the masking."""
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def fight_keys(seed, first_fight, fight_count):
+    """combat.fight_key(seed, i) for i in first_fight .. first_fight + fight_count - 1."""
+    base = np.uint64((seed * combat._FIGHT_KEY_MULTIPLIER) & combat._MASK64) # pylint: disable=protected-access
+    indices = np.arange(first_fight, first_fight + fight_count, dtype=np.uint64)
+    return _splitmix64(base + indices)
+
+
+def turn_draws(keys, round_number):
+    """combat.turn_draw(key, round_number) for an array of fight keys."""
+    return (_splitmix64(keys + np.uint64(round_number)) >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+
+def fight_batch(player_stats, npc_stats, policy, seed, first_fight, fight_count, max_rounds=combat.DEFAULT_MAX_ROUNDS):
+    """Plays fights first_fight .. first_fight + fight_count - 1 like combat.fight() would. Returns BatchTotals."""
+    if not numpy_available:
+        raise RuntimeError("The numpy combat backend needs NumPy (pip install numpy).")
+    totals = BatchTotals()
+    moves = combat.moves_by_damage(player_stats)
+    move_damage = np.array([damage for _move_id, _move, damage in moves], dtype=np.int64)
+    move_cooldown = np.array([move.get("cooldown_max", 0) for _move_id, move, _damage in moves], dtype=np.int64)
+    player_attack = combat.attack_damage(player_stats["attack_power"])
+    npc_damage = combat.npc_attack_damage(npc_stats["attack_power"], False)
+    npc_damage_deflected = combat.npc_attack_damage(npc_stats["attack_power"], True)
+    deflect_chance = policy.deflect_chance
+    special_threshold = policy.special_threshold
+
+    # Only the fights still going are kept; finished ones are dropped from every array after each round
+    keys = fight_keys(seed, first_fight, fight_count)
+    player_hp = np.full(fight_count, player_stats["hp"], dtype=np.int64)
+    npc_hp = np.full(fight_count, npc_stats["hp"], dtype=np.int64)
+    cooldowns = np.zeros((fight_count, len(moves)), dtype=np.int64)
+
+    for round_number in range(1, max_rounds + 1):
+        if not len(keys):
+            break
+        draws = turn_draws(keys, round_number)
+        deflect = draws < deflect_chance
+        damage = np.where(deflect, 0, player_attack)
+        if moves:
+            ready = cooldowns == 0
+            ready_move = ready.argmax(axis=1) # Moves are sorted strongest first, so this is the first ready one
+            special = ~deflect & ready.any(axis=1) & (draws < special_threshold)
+            special_rows = np.flatnonzero(special)
+            special_moves = ready_move[special_rows]
+            damage[special_rows] = move_damage[special_moves]
+            cooldowns[special_rows, special_moves] = move_cooldown[special_moves]
+        npc_hp = np.maximum(0, npc_hp - damage)
+
+        won = npc_hp <= 0
+        player_hp = np.where(won, player_hp, np.maximum(0, player_hp - np.where(deflect, npc_damage_deflected, npc_damage)))
+        lost = ~won & (player_hp <= 0)
+        wins = int(won.sum())
+        if wins:
+            totals.outcomes[combat.OUTCOME_WON] += wins
+            totals.time_to_kill[round_number] += wins
+            totals.won_hp_sum += int(player_hp[won].sum())
+        if lost.any():
+            totals.outcomes[combat.OUTCOME_LOST] += int(lost.sum())
+        totals.hp_sums.append(int(player_hp.sum()))
+        totals.hp_counts.append(len(player_hp))
+
+        going = ~won & ~lost
+        keys, player_hp, npc_hp = keys[going], player_hp[going], npc_hp[going]
+        cooldowns = np.maximum(0, cooldowns[going] - 1)
+    if len(keys):
+        totals.outcomes[combat.OUTCOME_TIMEOUT] += len(keys)
+    return totals
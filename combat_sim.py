@@ -0,0 +1,251 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\combat_sim.py
+# Monte Carlo balance runs of the combat rules (combat.py), for tuning data/classes.json and data/species.json.
+# Every species x class preset (at a given level) fights every hostile NPC in data/locations.json many times,
+# with the player's choices drawn from a FightPolicy. The fights are split into chunks and run on all cores.
+# Because each fight's random numbers depend only on (seed, matchup, fight index), the results are the same
+# however the work is split, and the same with --backend numpy (combat_numpy.py), which plays whole chunks as
+# arrays. The report gives per matchup the win rate, the distribution of rounds needed to win (time to kill),
+# and the player's average HP per round.
+#   python combat_sim.py --fights 100000 --level 1 --deflect 0.1 --special 0.8 --json report.json
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import combat
+import combat_numpy
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(SCRIPT_DIR, "data")
+DEFAULT_FIGHTS_PER_MATCHUP = 10000
+DEFAULT_CHUNK_FIGHTS = 25000 # Fights per task handed to a worker process
+TIME_TO_KILL_PERCENTILES = (10, 50, 90)
+
+
+# --- Presets from the game data ---
+def player_preset(species_id, class_id, species_data, classes_data, level=1):
+    """Combat stats of a new character of this species and class (see game_logic.apply_character_choices_and_stats),
+    with the level-up bonuses of Player.add_xp for every level above 1. Equipment is not included."""
+    class_info = classes_data[class_id]
+    species_info = species_data[species_id]
+    class_stats = class_info["base_stats"]
+    species_bonuses = species_info.get("stat_bonuses", {})
+    return {
+        "name": f"{species_info['name']} {class_info['name']}",
+        "species_id": species_id,
+        "class_id": class_id,
+        "level": level,
+        "hp": class_stats["hp"] + species_bonuses.get("hp_bonus", 0) + 10 * (level - 1),
+        "attack_power": class_stats["attack_power"] + species_bonuses.get("attack_bonus", 0) + 2 * (level - 1),
+        "special_moves": dict(class_info.get("special_moves", {}))
+    }
+
+
+def player_presets(species_data, classes_data, level=1):
+    return [player_preset(species_id, class_id, species_data, classes_data, level)
+            for species_id in sorted(species_data) for class_id in sorted(classes_data)]
+
+
+def npc_presets(locations_data):
+    """Every hostile NPC placed in the locations, with the NPC class defaults for missing stats."""
+    presets = []
+    for loc_id in sorted(locations_data):
+        for npc_id, npc_data in sorted(locations_data[loc_id].get("npcs", {}).items()):
+            if not npc_data.get("hostile"):
+                continue
+            presets.append({
+                "name": npc_data.get("name", npc_id),
+                "npc_id": npc_id,
+                "location_id": loc_id,
+                "hp": npc_data.get("max_hp", npc_data.get("hp", 10)),
+                "attack_power": npc_data.get("attack_power", 1)
+            })
+    return presets
+
+
+def load_presets(data_dir=DATA_DIR, level=1):
+    def read(filename):
+        with open(os.path.join(data_dir, filename), "r", encoding="utf-8") as f:
+            return json.load(f)
+    locations_data = read("locations.json")
+    starter_room_path = os.path.join(data_dir, "generic_start_room.json")
+    if os.path.exists(starter_room_path):
+        locations_data.update(read("generic_start_room.json"))
+    return player_presets(read("species.json"), read("classes.json"), level), npc_presets(locations_data)
+
+
+# --- Running fights ---
+class MatchupStats:
+    """Aggregated results of many fights between one player preset and one NPC. Chunks merge with merge()."""
+
+    def __init__(self):
+        self.outcomes = Counter()
+        self.time_to_kill = Counter() # Rounds needed -> number of won fights
+        self.won_hp_sum = 0           # Player HP left at the end of won fights, summed
+        self.hp_sums = []             # Round - 1 -> sum of player HP at the end of that round, over fights that reached it
+        self.hp_counts = []           # Round - 1 -> number of fights that reached that round
+
+    def add(self, result):
+        self.outcomes[result.outcome] += 1
+        if result.outcome == combat.OUTCOME_WON:
+            self.time_to_kill[result.rounds] += 1
+            self.won_hp_sum += result.player_hp
+        self.add_hp_curve(result.hp_curve)
+
+    def add_hp_curve(self, hp_curve):
+        missing = len(hp_curve) - len(self.hp_sums)
+        if missing > 0:
+            self.hp_sums.extend([0] * missing)
+            self.hp_counts.extend([0] * missing)
+        for index, hp in enumerate(hp_curve):
+            self.hp_sums[index] += hp
+            self.hp_counts[index] += 1
+
+    def merge(self, other):
+        self.outcomes.update(other.outcomes)
+        self.time_to_kill.update(other.time_to_kill)
+        self.won_hp_sum += other.won_hp_sum
+        missing = len(other.hp_sums) - len(self.hp_sums)
+        if missing > 0:
+            self.hp_sums.extend([0] * missing)
+            self.hp_counts.extend([0] * missing)
+        for index, (hp_sum, count) in enumerate(zip(other.hp_sums, other.hp_counts)):
+            self.hp_sums[index] += hp_sum
+            self.hp_counts[index] += count
+
+    @property
+    def fights(self):
+        return sum(self.outcomes.values())
+
+    def time_to_kill_percentile(self, percentile):
+        wins = self.outcomes[combat.OUTCOME_WON]
+        if not wins:
+            return None
+        rank = max(1, -(-wins * percentile // 100)) # Nearest-rank method
+        seen = 0
+        for rounds in sorted(self.time_to_kill):
+            seen += self.time_to_kill[rounds]
+            if seen >= rank:
+                return rounds
+        return None
+
+    def summary(self):
+        fights = self.fights or 1
+        wins = self.outcomes[combat.OUTCOME_WON]
+        return {
+            "fights": self.fights,
+            "win_rate": wins / fights,
+            "loss_rate": self.outcomes[combat.OUTCOME_LOST] / fights,
+            "timeout_rate": self.outcomes[combat.OUTCOME_TIMEOUT] / fights,
+            "time_to_kill": {f"p{percentile}": self.time_to_kill_percentile(percentile) for percentile in TIME_TO_KILL_PERCENTILES},
+            "time_to_kill_histogram": {str(rounds): count for rounds, count in sorted(self.time_to_kill.items())},
+            "mean_hp_left_on_win": self.won_hp_sum / wins if wins else None,
+            "hp_curve": [{"round": index + 1, "mean_hp": hp_sum / count, "fights": count}
+                         for index, (hp_sum, count) in enumerate(zip(self.hp_sums, self.hp_counts))]
+        }
+
+
+def simulate_chunk_python(player_stats, npc_stats, policy, seed, first_fight, fight_count, max_rounds):
+    stats = MatchupStats()
+    for fight_index in range(first_fight, first_fight + fight_count):
+        stats.add(combat.fight(player_stats, npc_stats, policy, seed, fight_index, max_rounds))
+    return stats
+
+
+def simulate_chunk_numpy(player_stats, npc_stats, policy, seed, first_fight, fight_count, max_rounds):
+    stats = MatchupStats()
+    stats.merge(combat_numpy.fight_batch(player_stats, npc_stats, policy, seed, first_fight, fight_count, max_rounds))
+    return stats
+
+
+BACKENDS = {"python": simulate_chunk_python, "numpy": simulate_chunk_numpy}
+
+
+def _run_task(task):
+    backend, matchup_index, player_stats, npc_stats, policy_settings, seed, first_fight, fight_count, max_rounds = task
+    policy = combat.FightPolicy(**policy_settings)
+    return matchup_index, BACKENDS[backend](player_stats, npc_stats, policy, seed, first_fight, fight_count, max_rounds)
+
+
+def simulate(players, npcs, fights_per_matchup=DEFAULT_FIGHTS_PER_MATCHUP, policy=None, seed=0,
+             max_rounds=combat.DEFAULT_MAX_ROUNDS, workers=None, backend="python", chunk_fights=DEFAULT_CHUNK_FIGHTS):
+    """Runs every player preset against every NPC. Returns [(player preset, npc, MatchupStats)].
+
+    workers=1 runs everything in this process; None uses one process per core.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown combat backend '{backend}'. Choose one of: {', '.join(sorted(BACKENDS))}.")
+    if backend == "numpy" and not combat_numpy.numpy_available:
+        raise ValueError("The numpy combat backend needs NumPy (pip install numpy).")
+    policy = policy or combat.FightPolicy()
+    matchups = [(player, npc) for player in players for npc in npcs]
+    tasks = []
+    for matchup_index, (player, npc) in enumerate(matchups):
+        matchup_seed = combat.fight_key(seed, matchup_index) # Each matchup gets its own stream of fights
+        for first_fight in range(0, fights_per_matchup, chunk_fights):
+            fight_count = min(chunk_fights, fights_per_matchup - first_fight)
+            tasks.append((backend, matchup_index, player, npc, policy.to_dict(), matchup_seed, first_fight, fight_count, max_rounds))
+
+    results = [MatchupStats() for _ in matchups]
+    if workers == 1 or len(tasks) <= 1:
+        for matchup_index, partial in map(_run_task, tasks):
+            results[matchup_index].merge(partial)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for matchup_index, partial in executor.map(_run_task, tasks):
+                results[matchup_index].merge(partial)
+    return [(player, npc, stats) for (player, npc), stats in zip(matchups, results)]
+
+
+def format_report(results):
+    header = f"{'Player':<22} {'Lvl':>3}  {'NPC':<22} {'Win %':>6} {'Lose %':>6} {'TTK p10/p50/p90':>16} {'HP left':>8}"
+    lines = [header, "-" * len(header)]
+    for player, npc, stats in results:
+        summary = stats.summary()
+        ttk = "/".join("-" if value is None else str(value) for value in summary["time_to_kill"].values())
+        hp_left = "-" if summary["mean_hp_left_on_win"] is None else f"{summary['mean_hp_left_on_win']:.1f}"
+        lines.append(f"{player['name']:<22} {player['level']:>3}  {npc['name']:<22} {summary['win_rate'] * 100:>6.1f} "
+                     f"{summary['loss_rate'] * 100:>6.1f} {ttk:>16} {hp_left:>8}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo combat balance runs for Adventure of Textland.")
+    parser.add_argument("--fights", type=int, default=DEFAULT_FIGHTS_PER_MATCHUP, help="fights per player preset x NPC")
+    parser.add_argument("--level", type=int, default=1, help="player level")
+    parser.add_argument("--deflect", type=float, default=0.0, help="chance the player deflects in a round")
+    parser.add_argument("--special", type=float, default=1.0, help="chance the player uses a ready special move")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-rounds", type=int, default=combat.DEFAULT_MAX_ROUNDS)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="python")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--json", dest="json_path", help="also write the full report (histograms, HP curves) here")
+    args = parser.parse_args(argv)
+
+    players, npcs = load_presets(args.data_dir, args.level)
+    policy = combat.FightPolicy(deflect_chance=args.deflect, special_chance=args.special)
+    started_at = time.perf_counter()
+    try:
+        results = simulate(players, npcs, args.fights, policy, args.seed, args.max_rounds, args.workers, args.backend)
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - started_at
+    total_fights = sum(stats.fights for _player, _npc, stats in results)
+    print(format_report(results))
+    print(f"\n{total_fights} fights in {elapsed:.2f}s ({total_fights / max(elapsed, 1e-9):,.0f} fights/s, {args.backend} backend).")
+    if args.json_path:
+        report = {
+            "settings": {"fights": args.fights, "level": args.level, "seed": args.seed, "max_rounds": args.max_rounds,
+                         "policy": policy.to_dict(), "backend": args.backend},
+            "matchups": [{"player": player, "npc": npc, **stats.summary()} for player, npc, stats in results]
+        }
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Full report written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\commands.py
+# Command registry used by both the terminal (process_command) and the web (/process_game_action) front ends.
+# A registry maps verbs and their aliases to the commands registered for them, so dispatch is a single
+# dict lookup instead of walking an if/elif chain.
+# Several commands may share a verb (e.g. "open worn crate" and the generic "open <feature>"); they are tried
+# in registration order and a command that doesn't apply returns NOT_HANDLED to pass on to the next one.
+# Middleware wraps command handlers: middleware(ctx, call_next) -> result. Per-command middleware
+# (preconditions) runs first, then the registry-wide middleware (timing, tracing), so commands that
+# turn out not to apply are never timed or traced.
+
+NOT_HANDLED = object() # Returned by a handler (or precondition) when the command doesn't apply to this input
+
+
+class CommandContext:
+    """One parsed command as seen by a handler."""
+
+    def __init__(self, verb, args, raw_input, frontend, response=None):
+        self.verb = verb             # First word, lowercased (may be an alias)
+        self.args = args             # Remaining words
+        self.raw_input = raw_input
+        self.frontend = frontend     # "terminal" or "web"
+        self.response = response     # Web only: the game_response dict being built
+        self.command_name = None     # Set to the primary verb of the command that handles it, if any
+        self.failed = False          # Set by fail(); a batch of web actions stops at a failed one
+
+    @property
+    def arg_text(self):
+        return " ".join(self.args)
+
+    def fail(self, message=None):
+        """Marks the command as not carried out (e.g. a blocked exit), with message as the web response's message."""
+        self.failed = True
+        if message is not None and self.response is not None:
+            self.response["message"] = message
+
+
+class Command:
+    def __init__(self, name, handler, aliases=(), middleware=(), description=""):
+        self.name = name
+        self.handler = handler
+        self.aliases = tuple(aliases)
+        self.middleware = tuple(middleware)
+        self.description = description
+
+
+class CommandRegistry:
+    def __init__(self, name, middleware=()):
+        self.name = name
+        self.middleware = list(middleware) # Applied around every command in this registry, inside its own middleware
+        self._commands_by_verb = {}        # verb or alias -> [Command, ...] in registration order
+
+    def register(self, name, handler, aliases=(), middleware=(), requires_args=None, description=""):
+        """Registers handler(ctx) for a verb and its aliases.
+
+        requires_args=True/False only lets the command apply when arguments are (or aren't) given.
+        """
+        command_middleware = list(middleware)
+        if requires_args is not None:
+            command_middleware.insert(0, precondition(lambda ctx: bool(ctx.args) == requires_args))
+        command = Command(name, handler, aliases, command_middleware, description)
+        for verb in (name,) + command.aliases:
+            self._commands_by_verb.setdefault(verb, []).append(command)
+        return command
+
+    def command(self, name, **kwargs):
+        """Decorator form of register()."""
+        def decorator(handler):
+            self.register(name, handler, **kwargs)
+            return handler
+        return decorator
+
+    def commands_for(self, verb):
+        return self._commands_by_verb.get(verb, ())
+
+    def verbs(self):
+        return list(self._commands_by_verb)
+
+    def __contains__(self, verb):
+        return verb in self._commands_by_verb
+
+    def dispatch(self, ctx):
+        """Runs the first command registered for ctx.verb that handles it. Returns its result, or NOT_HANDLED."""
+        for command in self._commands_by_verb.get(ctx.verb, ()):
+            ctx.command_name = command.name
+            result = self._run(command, ctx)
+            if result is not NOT_HANDLED:
+                return result
+        ctx.command_name = None
+        return NOT_HANDLED
+
+    def _run(self, command, ctx):
+        chain = list(command.middleware) + self.middleware
+
+        def call(index, current_ctx):
+            if index == len(chain):
+                return command.handler(current_ctx)
+            return chain[index](current_ctx, lambda next_ctx: call(index + 1, next_ctx))
+        return call(0, ctx)
+
+
+def precondition(check, on_failure=None):
+    """Middleware that only runs the command when check(ctx) is true.
+
+    Otherwise on_failure(ctx) is called and its result returned; without on_failure the command is
+    skipped (NOT_HANDLED), so the next command registered for the verb gets a chance.
+    """
+    def middleware(ctx, call_next):
+        if check(ctx):
+            return call_next(ctx)
+        return on_failure(ctx) if on_failure else NOT_HANDLED
+    return middleware
+
+
+def arg_text_is(text):
+    """Precondition middleware: the arguments, joined with spaces, must equal text (e.g. "enter city")."""
+    return precondition(lambda ctx: ctx.arg_text == text)
@@ -1,6 +1,21 @@
 # d:\GeneralRepository\PythonProjects\AdventureOfTextland\entities.py
+import combat
 
 class Player:
+    # Slots instead of a per-instance __dict__: less memory per player and no attributes appearing by typo.
+    # Everything the player saves is listed here; to_save_dict()/from_save_dict() convert to and from save files.
+    SAVED_ATTRIBUTES = (
+        "name", "gender", "species_id", "class_id",
+        "current_location_id", "current_map_type", "current_city_id", "current_city_x", "current_city_y",
+        "last_zone_location_id", "respawn_location_id", "inventory", "game_active",
+        "base_max_hp", "base_attack_power", "hp", "max_hp", "attack_power",
+        "special_power", "special_moves", "special_cooldowns", "combat_target_id", "is_deflecting",
+        "dialogue_npc_id", "dialogue_options_pending", "flags", "coins", "level", "xp", "xp_to_next_level",
+        "equipment", "is_paused", "visited_locations", "preferences"
+    )
+    TRANSIENT_ATTRIBUTES = ("scene_dirty", "extra_state") # Runtime-only state that is left out of save files
+    __slots__ = SAVED_ATTRIBUTES + TRANSIENT_ATTRIBUTES
+
     def __init__(self, name="Adventurer", gender="Unspecified"):
         self.name = name
         self.gender = gender
@@ -14,6 +29,7 @@ class Player:
         self.current_city_x = None
         self.current_city_y = None
         self.last_zone_location_id = None # To remember the zone map node when entering a city
+        self.respawn_location_id = None # Last city the game was saved in
         self.inventory = []
         self.game_active = False
 
@@ -50,6 +66,30 @@ class Player:
         self.preferences = {
             "auto_equip_from_inventory_panel_enabled": False
         }
+        self.scene_dirty = set() # Web scene sections (see scene.py) to rebuild on the next response
+        self.extra_state = {} # Save fields this version doesn't know (e.g. from older saves), written back unchanged
+
+    def to_save_dict(self):
+        """The player's saved state as a JSON-ready dict (sets become lists)."""
+        state = dict(self.extra_state)
+        for attribute in self.SAVED_ATTRIBUTES:
+            state[attribute] = getattr(self, attribute)
+        state["visited_locations"] = list(self.visited_locations)
+        return state
+
+    @classmethod
+    def from_save_dict(cls, state):
+        """A Player restored from a dict written by to_save_dict()."""
+        loaded_player = cls(name=state.get("name", "Adventurer"), gender=state.get("gender", "Unspecified"))
+        for key, value in state.items():
+            if key in cls.SAVED_ATTRIBUTES:
+                setattr(loaded_player, key, value)
+            else:
+                loaded_player.extra_state[key] = value
+        # Ensure it's always a set, even if missing from old save or malformed
+        visited_locations = state.get("visited_locations")
+        loaded_player.visited_locations = set(visited_locations) if isinstance(visited_locations, list) else set()
+        return loaded_player
 
     def _recalculate_derived_stats(self, items_master_data):
         """Recalculates derived stats based on base stats, class/species, and equipment."""
@@ -74,6 +114,10 @@ class Player:
             self.hp = self.max_hp
         # print(f"Stats recalculated: MaxHP={self.max_hp}, Attack={self.attack_power}")
 
+    def mark_scene_dirty(self, *sections):
+        """Flags cached web scene sections ("equipment", "inventory", "room", "map") for rebuilding; no arguments flags all."""
+        self.scene_dirty.update(sections or ("all",))
+
     def set_active(self, is_active):
         self.game_active = is_active
 
@@ -96,6 +140,7 @@ class Player:
     def move_to(self, new_location_id):
         self.current_location_id = new_location_id
         self.visited_locations.add(new_location_id) # Record visited location
+        self.mark_scene_dirty("room", "map")
         # print(f"{self.name} moves to {new_location_id}.")
 
     def take_damage(self, amount):
@@ -112,11 +157,13 @@ class Player:
 
     def add_item_to_inventory(self, item_id):
         self.inventory.append(item_id)
+        self.mark_scene_dirty("inventory")
         # print(f"{item_id} added to inventory.")
 
     def remove_item_from_inventory(self, item_id):
         if item_id in self.inventory:
             self.inventory.remove(item_id)
+            self.mark_scene_dirty("inventory")
             # print(f"{item_id} removed from inventory.")
             return True
         return False
@@ -144,6 +191,7 @@ class Player:
         self.equipment[slot_to_equip_to] = item_id_to_equip
         self.remove_item_from_inventory(item_id_to_equip) # Assumes item was in inventory
         message += f"You equipped {item_details.get('name', item_id_to_equip)}."
+        self.mark_scene_dirty("equipment")
         self._recalculate_derived_stats(items_master_data)
         if log_event_func:
             log_event_func("item_equipped", {"item_id": item_id_to_equip, "slot": slot_to_equip_to, "player_name": self.name})
@@ -155,6 +203,7 @@ class Player:
         if item_id_to_unequip:
             self.add_item_to_inventory(item_id_to_unequip)
             self.equipment[slot_key] = None
+            self.mark_scene_dirty("equipment")
             item_name = items_master_data.get(item_id_to_unequip, {}).get("name", item_id_to_unequip)
             self._recalculate_derived_stats(items_master_data)
             if log_event_func:
@@ -200,9 +249,7 @@ class Player:
         # print(f"Gained {amount} coins. Total: {self.coins}")
 
     def update_special_cooldowns(self):
-        for move in self.special_cooldowns:
-            if self.special_cooldowns[move] > 0:
-                self.special_cooldowns[move] -= 1
+        combat.tick_cooldowns(self.special_cooldowns)
 
     def set_deflecting(self, is_deflecting_flag):
         self.is_deflecting = is_deflecting_flag
@@ -217,27 +264,44 @@ class Player:
 # d:\GeneralRepository\PythonProjects\AdventureOfTextland\entities.py
 # ... (Player class above) ...
 
-class NPC:
+_NO_ENTRIES = {} # Shared by every template without wares, stock or dialogue options; never modified
+
+
+class NPCTemplate:
+    """An NPC as defined in data/locations.json: stats, loot, dialogue, quest and merchant data.
+
+    Templates are shared by every NPC spawned from the same definition (and by every session) and are
+    never changed after loading; what changes during play (HP, stock) lives in the NPC instance.
+    """
+
+    __slots__ = (
+        "id", "name", "description", "dialogue", "type", "hostile", "hp", "max_hp", "attack_power", "loot",
+        "dialogue_options", "pre_combat_dialogue", "quest_item_needed", "quest_reward_item",
+        "dialogue_after_quest_complete", "dialogue_after_quest_incomplete", "quest_reward_currency", "wares", "stock",
+        "respawn_seconds"
+    )
+
     def __init__(self, npc_id, name, description, dialogue="...", npc_type="neutral", hostile=False,
                  hp=10, max_hp=10, attack_power=1, loot=None,
                  dialogue_options=None, pre_combat_dialogue=None,
                  quest_item_needed=None, quest_reward_item=None, dialogue_after_quest_complete=None,
-                 dialogue_after_quest_incomplete=None, quest_reward_currency=0, wares=None, stock=None):
+                 dialogue_after_quest_incomplete=None, quest_reward_currency=0, wares=None, stock=None,
+                 respawn_seconds=None):
         self.id = npc_id
         self.name = name
         self.description = description
         self.dialogue = dialogue # Default dialogue
         self.type = npc_type
         # Merchant specific attributes
-        self.wares = wares if wares is not None else {}
-        self.stock = stock if stock is not None else {}
+        self.wares = wares or _NO_ENTRIES
+        self.stock = stock or _NO_ENTRIES # Stock a new instance starts with
         # Combat related attributes
         self.hostile = hostile
-        self.hp = hp
+        self.hp = hp # HP a new instance starts with
         self.max_hp = max_hp
         self.attack_power = attack_power
-        self.loot = loot if loot is not None else []
-        self.dialogue_options = dialogue_options if dialogue_options is not None else {}
+        self.loot = tuple(loot) if loot else ()
+        self.dialogue_options = dialogue_options or _NO_ENTRIES
         self.pre_combat_dialogue = pre_combat_dialogue
         # Quest related attributes
         self.quest_item_needed = quest_item_needed
@@ -245,6 +309,46 @@ class NPC:
         self.dialogue_after_quest_complete = dialogue_after_quest_complete
         self.dialogue_after_quest_incomplete = dialogue_after_quest_incomplete
         self.quest_reward_currency = quest_reward_currency
+        self.respawn_seconds = respawn_seconds # None: the game's default (see spawns.py); 0 or False: never respawns
+
+    def spawn(self):
+        """A new NPC of this template, at full starting HP and stock."""
+        return NPC(self)
+
+    @classmethod
+    def from_definition(cls, npc_id, definition):
+        """A template from an NPC's entry in the location data ("type" is the NPC type)."""
+        init_kwargs = dict(definition)
+        if "type" in init_kwargs:
+            init_kwargs["npc_type"] = init_kwargs.pop("type") # Rename key for constructor
+        return cls(npc_id=npc_id, **init_kwargs)
+
+
+class NPC:
+    """An NPC in the world: its template plus the state that changes during play (HP and stock).
+
+    Every other attribute (name, loot, dialogue_options...) is read from the shared template.
+    """
+
+    __slots__ = ("template", "hp", "_stock")
+
+    def __init__(self, template, hp=None, stock=None):
+        self.template = template
+        self.hp = template.hp if hp is None else hp
+        self._stock = stock # None until this NPC sells something; until then it has the template's stock
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "template": # Not set yet (e.g. while unpickling); don't recurse
+            raise AttributeError(name)
+        return getattr(self.template, name)
+
+    @property
+    def stock(self):
+        return self.template.stock if self._stock is None else self._stock
+
+    def copy(self):
+        """A separate NPC with the same template and state, which can be changed without affecting this one."""
+        return NPC(self.template, self.hp, None if self._stock is None else dict(self._stock))
 
     def is_alive(self):
         return self.hp > 0
@@ -266,4 +370,6 @@ class NPC:
     def reduce_stock(self, item_id):
         """Reduce stock after purchase"""
         if self.stock.get(item_id, 0) > 0:
-            self.stock[item_id] -= 1
+            if self._stock is None:
+                self._stock = dict(self.template.stock)
+            self._stock[item_id] -= 1
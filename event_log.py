@@ -0,0 +1,209 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\event_log.py
+# Buffered, batched writer for the per-character events.jsonl logs.
+# Game code hands events to EventLogWriter.write(), which only encodes the line and queues it.
+# A background thread flushes each character's queue in order, either when enough lines are
+# buffered or after flush_interval seconds, using file handles that are kept open between flushes.
+# Logs that grow beyond rotate_bytes are rotated and gzipped.
+import atexit
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+EVENT_LOG_FILENAME = "events.jsonl"
+DEFAULT_FLUSH_INTERVAL_SECONDS = 1.0
+DEFAULT_FLUSH_BATCH_SIZE = 64         # A character's queue is flushed early once this many lines are waiting
+DEFAULT_MAX_BUFFERED_PER_CHARACTER = 1024 # Beyond this, write() flushes inline instead of growing the queue
+DEFAULT_MAX_OPEN_FILES = 64           # Least recently used log files are closed beyond this
+
+
+class _CharacterLog:
+    def __init__(self, character_dir):
+        self.character_dir = character_dir
+        self.path = os.path.join(character_dir, EVENT_LOG_FILENAME)
+        self.pending = []                  # Encoded lines not yet written, oldest first
+        self.pending_lock = threading.Lock()
+        self.write_lock = threading.Lock() # Held while a batch is written, so batches never interleave
+        self.file = None
+
+
+class EventLogWriter:
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL_SECONDS, flush_batch_size=DEFAULT_FLUSH_BATCH_SIZE,
+                 max_buffered_per_character=DEFAULT_MAX_BUFFERED_PER_CHARACTER, max_open_files=DEFAULT_MAX_OPEN_FILES,
+                 rotate_bytes=None, on_flush=None):
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self.max_buffered_per_character = max_buffered_per_character
+        self.max_open_files = max_open_files
+        self.rotate_bytes = rotate_bytes # None disables rotation
+        self.on_flush = on_flush         # Optional callback(duration_seconds, line_count) after each batch write, for metrics
+        self._logs = {}                  # character_dir -> _CharacterLog
+        self._open_logs = OrderedDict()  # character_dir -> _CharacterLog with an open file, least recently used first
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def write(self, character_dir, entry):
+        """Queues one event (a JSON-serializable dict) for the character's events.jsonl."""
+        line = json.dumps(entry, separators=(",", ":")) + "\n" # Encoded now, so later changes to entry don't leak in
+        log = self._log_for(character_dir)
+        with log.pending_lock:
+            log.pending.append(line)
+            pending_count = len(log.pending)
+        if self._closed or pending_count >= self.max_buffered_per_character:
+            self._flush_log(log) # Queue is full (or the writer is shut down): write synchronously
+        elif pending_count >= self.flush_batch_size:
+            self._wakeup.set()
+        self._ensure_thread()
+
+    def flush(self, character_dir=None):
+        """Writes out everything queued (for one character, or for all of them) before returning."""
+        if character_dir is not None:
+            with self._lock:
+                log = self._logs.get(character_dir)
+            if log is not None:
+                self._flush_log(log)
+            return
+        with self._lock:
+            all_logs = list(self._logs.values())
+        for log in all_logs:
+            self._flush_log(log)
+
+    def close_character(self, character_dir):
+        """Flushes and closes a character's log, e.g. before their directory is deleted."""
+        with self._lock:
+            log = self._logs.pop(character_dir, None)
+        if log is not None:
+            self._flush_log(log)
+            with log.write_lock:
+                self._close_file(log)
+
+    def close(self):
+        """Flushes every queue and closes all files. Events written afterwards are written synchronously."""
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+        with self._lock:
+            all_logs = list(self._logs.values())
+        for log in all_logs:
+            with log.write_lock:
+                self._close_file(log)
+
+    # --- Internals ---
+    def _log_for(self, character_dir):
+        with self._lock:
+            log = self._logs.get(character_dir)
+            if log is None:
+                log = _CharacterLog(character_dir)
+                self._logs[character_dir] = log
+            return log
+
+    def _ensure_thread(self):
+        if self._thread is not None or self._closed:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="EventLogWriter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e: # pylint: disable=broad-except
+                print(f"[Error] Event log writer failed to flush: {e}")
+
+    def _flush_log(self, log):
+        with log.write_lock:
+            with log.pending_lock:
+                lines, log.pending = log.pending, []
+            if not lines:
+                return
+            start = time.perf_counter()
+            try:
+                if log.file is None:
+                    self._open_file(log)
+                log.file.write("".join(lines))
+                log.file.flush()
+            except Exception as e: # pylint: disable=broad-except
+                print(f"[Error] Failed to write to event log {log.path}: {e}")
+                self._close_file(log)
+                return
+            if self.on_flush:
+                self.on_flush(time.perf_counter() - start, len(lines))
+            self._touch_open_file(log)
+            if self.rotate_bytes and log.file.tell() >= self.rotate_bytes:
+                self._rotate(log)
+
+    def _open_file(self, log):
+        os.makedirs(log.character_dir, exist_ok=True)
+        log.file = open(log.path, "a", encoding="utf-8") # pylint: disable=consider-using-with
+
+    def _close_file(self, log):
+        if log.file is not None:
+            try:
+                log.file.close()
+            except OSError:
+                pass
+            log.file = None
+        with self._lock:
+            self._open_logs.pop(log.character_dir, None)
+
+    def _touch_open_file(self, log):
+        # Keeps the number of open handles bounded when many characters are active
+        to_close = []
+        with self._lock:
+            self._open_logs[log.character_dir] = log
+            self._open_logs.move_to_end(log.character_dir)
+            while len(self._open_logs) > self.max_open_files:
+                _dir, oldest_log = self._open_logs.popitem(last=False)
+                to_close.append(oldest_log)
+        for oldest_log in to_close:
+            if oldest_log is log:
+                continue
+            # Only close it if it isn't being written right now; it is simply reopened on its next flush
+            if oldest_log.write_lock.acquire(blocking=False):
+                try:
+                    self._close_file(oldest_log)
+                finally:
+                    oldest_log.write_lock.release()
+
+    def _rotate(self, log):
+        """Moves the full events.jsonl aside as events-<timestamp>.jsonl.gz. Caller holds log.write_lock."""
+        self._close_file(log)
+        rotated_base = os.path.join(log.character_dir, f"events-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}")
+        rotated_path = f"{rotated_base}.jsonl"
+        suffix = 1
+        while os.path.exists(f"{rotated_path}.gz"): # More than one rotation within the same second
+            rotated_path = f"{rotated_base}-{suffix}.jsonl"
+            suffix += 1
+        try:
+            os.replace(log.path, rotated_path)
+            with open(rotated_path, "rb") as source, gzip.open(f"{rotated_path}.gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotated_path)
+        except OSError as e:
+            print(f"[Error] Failed to rotate event log {log.path}: {e}")
+
+
+_default_writers = []
+
+
+def _close_default_writers():
+    for writer in _default_writers:
+        writer.close()
+
+
+def create_writer(**kwargs):
+    """Creates an EventLogWriter that is flushed and closed automatically when the interpreter exits."""
+    writer = EventLogWriter(**kwargs)
+    if not _default_writers:
+        atexit.register(_close_default_writers)
+    _default_writers.append(writer)
+    return writer
@@ -0,0 +1,286 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\event_store.py
+# Queryable store of the game events that log_game_event writes to player_data/<character>/events.jsonl.
+# ingest() streams new lines from every character's log (including rotated events-*.jsonl.gz files) into one
+# SQLite database, indexed by event type, time, player and location. It remembers how far it got in each file,
+# so each line is read once no matter how often it runs; only complete lines are taken, so a log that is being
+# written meanwhile is fine. The reports (XP per hour, item sources, coin flow, deaths per location) are then
+# aggregate queries over the indexed table instead of scans of the raw logs.
+import calendar
+import glob
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from event_log import EVENT_LOG_FILENAME
+
+EVENT_STORE_FILENAME = "events.sqlite3"
+ROTATED_LOG_PATTERN = "events-*.jsonl.gz"
+INGEST_BATCH_SIZE = 5000
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Item and coin sources name their origin first ("take_room_web_<location>", "quest_reward_<npc>"...). Reports group
+# them by these kinds, most specific first; the _web/_terminal variants of a source count as the same kind.
+SOURCE_KINDS = ("feature_interaction", "feature", "auto_converted", "opened", "quest_reward", "quest_turn_in",
+                "take_room", "used_item", "used_on")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY,
+        player TEXT NOT NULL,
+        event_type TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        location_id TEXT,
+        item_id TEXT,
+        amount INTEGER,
+        source TEXT,
+        source_kind TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS events_by_type_time ON events (event_type, ts);
+    CREATE INDEX IF NOT EXISTS events_by_player_time ON events (player, ts);
+    CREATE INDEX IF NOT EXISTS events_by_location ON events (location_id, event_type);
+    CREATE INDEX IF NOT EXISTS events_by_time ON events (ts);
+    CREATE TABLE IF NOT EXISTS ingested_files (
+        path TEXT PRIMARY KEY,
+        head TEXT NOT NULL,
+        offset INTEGER NOT NULL
+    );
+"""
+
+
+def source_kind(source):
+    if not source:
+        return None
+    for kind in SOURCE_KINDS:
+        if source == kind or source.startswith(kind + "_"):
+            return kind
+    return "other" if source != "unknown" else "unknown"
+
+
+def parse_timestamp(timestamp):
+    try:
+        return calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+    except (TypeError, ValueError):
+        return None
+
+
+def event_row(player, entry, line):
+    """The events table row for one decoded log line, or None if it isn't a usable event."""
+    if not isinstance(entry, dict) or not entry.get("event_type"):
+        return None
+    ts = parse_timestamp(entry.get("timestamp"))
+    if ts is None:
+        return None
+    amount = entry.get("amount")
+    source = entry.get("source")
+    return (player, entry["event_type"], ts, entry.get("location_id"), entry.get("item_id"),
+            amount if isinstance(amount, int) else None, source, source_kind(source), line)
+
+
+def _head_of(first_line):
+    """Identifies a log file by its first line, which survives rotation (the rotated .gz starts with it too)."""
+    return hashlib.sha256(first_line).hexdigest()
+
+
+class EventStore:
+    def __init__(self, database_path):
+        self.database_path = database_path
+        directory = os.path.dirname(database_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock() # One ingest or query at a time on the shared connection
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    # --- Ingestion ---
+    def ingest(self, player_data_dir):
+        """Adds every event logged since the last ingest. Returns the number of events added."""
+        if not os.path.isdir(player_data_dir):
+            return 0
+        added = 0
+        with self._lock:
+            for player in sorted(os.listdir(player_data_dir)):
+                character_dir = os.path.join(player_data_dir, player)
+                if os.path.isdir(character_dir):
+                    added += self._ingest_character(player, character_dir)
+        return added
+
+    def _ingest_character(self, player, character_dir):
+        added = 0
+        live_path = os.path.join(character_dir, EVENT_LOG_FILENAME)
+        live_state = self._file_state(live_path)
+        live_head = self._read_head(live_path, open)
+        if live_state is not None and live_head != live_state[0]:
+            # events.jsonl was rotated since the last ingest: the rest of the old one is in one of the .gz files
+            rotated_from = live_state
+            live_state = None
+        else:
+            rotated_from = None
+
+        # Rotated logs first (their names sort by time), then the live log
+        for gz_path in sorted(glob.glob(os.path.join(character_dir, ROTATED_LOG_PATTERN))):
+            if self._file_state(gz_path) is not None:
+                continue # Fully ingested before
+            head = self._read_head(gz_path, gzip.open)
+            if head is None:
+                continue
+            start = rotated_from[1] if rotated_from is not None and head == rotated_from[0] else 0
+            added += self._ingest_file(player, gz_path, gzip.open, head, start, complete=True)
+
+        if live_head is not None:
+            added += self._ingest_file(player, live_path, open, live_head, live_state[1] if live_state else 0, complete=False)
+        elif rotated_from is not None:
+            self._connection.execute("DELETE FROM ingested_files WHERE path = ?", (live_path,))
+            self._connection.commit()
+        return added
+
+    def _ingest_file(self, player, path, opener, head, start, complete):
+        """Reads complete lines from byte offset start on and records where it stopped."""
+        added = 0
+        offset = start
+        rows = []
+        try:
+            with opener(path, "rb") as f:
+                f.seek(start)
+                for raw_line in f:
+                    if not raw_line.endswith(b"\n") and not complete:
+                        break # Still being written; picked up next time
+                    offset += len(raw_line)
+                    line = raw_line.decode("utf-8", errors="replace").strip()
+                    if not line:
+                        continue
+                    try:
+                        row = event_row(player, json.loads(line), line)
+                    except ValueError:
+                        row = None
+                    if row is None:
+                        print(f"[Events] Skipping unreadable event in {path} at byte {offset - len(raw_line)}.")
+                        continue
+                    rows.append(row)
+                    if len(rows) >= INGEST_BATCH_SIZE:
+                        added += self._insert(rows, path, head, offset)
+                        rows = []
+        except (OSError, EOFError) as e:
+            print(f"[Events] Could not read {path}: {e}")
+        # Rows and the offset they lead up to are committed together, so a crash never ingests a line twice
+        added += self._insert(rows, path, head, offset)
+        return added
+
+    def _insert(self, rows, path, head, offset):
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO events (player, event_type, ts, location_id, item_id, amount, source, source_kind, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._connection.execute("INSERT OR REPLACE INTO ingested_files (path, head, offset) VALUES (?, ?, ?)",
+                                     (path, head, offset))
+        return len(rows)
+
+    def _file_state(self, path):
+        row = self._connection.execute("SELECT head, offset FROM ingested_files WHERE path = ?", (path,)).fetchone()
+        return tuple(row) if row else None
+
+    @staticmethod
+    def _read_head(path, opener):
+        try:
+            with opener(path, "rb") as f:
+                first_line = f.readline()
+        except (OSError, EOFError):
+            return None
+        return _head_of(first_line) if first_line.endswith(b"\n") else None
+
+    # --- Reports ---
+    def query(self, sql, params=()):
+        with self._lock:
+            cursor = self._connection.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def xp_per_hour(self, player=None, since=None):
+        """XP gained per player per hour (UTC), oldest first."""
+        where, params = _filters(player, since)
+        return self.query(
+            "SELECT player, strftime('%Y-%m-%dT%H:00Z', (ts / 3600) * 3600, 'unixepoch') AS hour, SUM(amount) AS xp, "
+            f"COUNT(*) AS events FROM events WHERE event_type = 'xp_gained'{where} GROUP BY player, ts / 3600 ORDER BY ts / 3600, player",
+            params)
+
+    def item_sources(self, player=None, since=None):
+        """How many items were acquired from each kind of source, by item."""
+        where, params = _filters(player, since)
+        return self.query(
+            "SELECT source_kind, item_id, COUNT(*) AS acquired FROM events "
+            f"WHERE event_type = 'item_acquisition'{where} GROUP BY source_kind, item_id ORDER BY acquired DESC, source_kind, item_id",
+            params)
+
+    def coin_flow(self, player=None, since=None):
+        """Copper coins gained per kind of source."""
+        where, params = _filters(player, since)
+        return self.query(
+            "SELECT source_kind, SUM(amount) AS copper, COUNT(*) AS events FROM events "
+            f"WHERE event_type = 'currency_gained'{where} GROUP BY source_kind ORDER BY copper DESC, source_kind",
+            params)
+
+    def deaths_per_location(self, player=None, since=None):
+        """Player defeats per location, most dangerous first."""
+        where, params = _filters(player, since)
+        return self.query(
+            "SELECT location_id, COUNT(*) AS deaths, COUNT(DISTINCT player) AS players FROM events "
+            f"WHERE event_type = 'player_defeated'{where} GROUP BY location_id ORDER BY deaths DESC, location_id",
+            params)
+
+    def event_counts(self, player=None, since=None):
+        """Number of events of each type."""
+        where, params = _filters(player, since)
+        return self.query(
+            f"SELECT event_type, COUNT(*) AS events FROM events WHERE 1 = 1{where} GROUP BY event_type ORDER BY events DESC, event_type",
+            params)
+
+
+# Report name -> EventStore method, for the command line and the /api/analytics route
+REPORTS = {
+    "xp_per_hour": EventStore.xp_per_hour,
+    "item_sources": EventStore.item_sources,
+    "coin_flow": EventStore.coin_flow,
+    "deaths_per_location": EventStore.deaths_per_location,
+    "event_counts": EventStore.event_counts
+}
+
+
+def run_report(store, report_name, player=None, since=None):
+    """Rows of a named report. since is a UTC timestamp like 2025-01-31T00:00:00Z. Raises KeyError for unknown reports."""
+    since_ts = None
+    if since:
+        since_ts = parse_timestamp(since)
+        if since_ts is None:
+            raise ValueError(f"'since' must look like {time.strftime(TIMESTAMP_FORMAT, time.gmtime(0))}.")
+    return REPORTS[report_name](store, player=player, since=since_ts)
+
+
+def _filters(player, since):
+    clauses, params = [], []
+    if player:
+        clauses.append(" AND player = ?")
+        params.append(player)
+    if since is not None:
+        clauses.append(" AND ts >= ?")
+        params.append(since)
+    return "".join(clauses), params
+
+
+def format_rows(rows):
+    """Rows as an aligned plain-text table for the terminal."""
+    if not rows:
+        return "(no events)"
+    columns = list(rows[0])
+    widths = [max(len(str(column)), *(len(str(row[column])) for row in rows)) for column in columns]
+    lines = ["  ".join(str(column).ljust(width) for column, width in zip(columns, widths)),
+             "  ".join("-" * width for width in widths)]
+    lines.extend("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)) for row in rows)
+    return "\n".join(lines)
@@ -0,0 +1,134 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\game_clock.py
+# The game clock, and the scheduler for everything that happens at a game time rather than in reply to a
+# command: harvested features regrowing (and telling the player), defeated NPCs respawning in web sessions
+# (and the scene being pushed to the browser). Each world's respawns are also timed by this clock (see spawns.py),
+# so terminal play, which has no push channel, brings its NPCs back when it next reads the world...
+# Game time is in seconds and starts at the wall-clock time the game started, so times like a feature's
+# last_harvested look the same as before. Two modes:
+#  - real time (default): game time runs with time.monotonic(), so it never jumps when the system clock is
+#    changed, and a background thread runs each event when it is due.
+#  - manual (TEXTLAND_CLOCK=manual, for tests and simulations): time stands still until advance() moves it,
+#    which fast-forwards through every event on the way, each run at its own due time.
+# Events due at the same time run in the order they were scheduled, so a manual run is always the same.
+import heapq
+import itertools
+import math
+import threading
+import time
+
+MODE_REAL_TIME = "realtime"
+MODE_MANUAL = "manual"
+MODES = (MODE_REAL_TIME, MODE_MANUAL)
+
+
+class GameClock:
+    """Game time, plus the events waiting to run at a game time."""
+
+    def __init__(self, mode=MODE_REAL_TIME, start_time=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown clock mode '{mode}'. Choose one of: {', '.join(MODES)}.")
+        self.mode = mode
+        self._start_time = time.time() if start_time is None else start_time
+        self._monotonic_start = time.monotonic()
+        self._skipped = 0.0     # Seconds added by advance()
+        self._heap = []         # (due game time, sequence, callback, args); cancelled events stay until they come up
+        self._pending = set()   # Sequences of the events that are still to run
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def now(self):
+        """Current game time in seconds."""
+        if self.mode == MODE_MANUAL:
+            return self._start_time + self._skipped
+        return self._start_time + (time.monotonic() - self._monotonic_start) + self._skipped
+
+    # --- Scheduling ---
+    def call_at(self, game_time, callback, *args):
+        """Runs callback(*args) at game_time. Returns a handle for cancel()."""
+        with self._condition:
+            sequence = next(self._sequence)
+            heapq.heappush(self._heap, (game_time, sequence, callback, args))
+            self._pending.add(sequence)
+            if self.mode == MODE_REAL_TIME and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="textland-game-clock", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return sequence
+
+    def call_later(self, delay_seconds, callback, *args):
+        return self.call_at(self.now() + delay_seconds, callback, *args)
+
+    def cancel(self, handle):
+        with self._condition:
+            self._pending.discard(handle)
+
+    def next_due(self):
+        """Game time of the next event, or None if nothing is scheduled."""
+        with self._condition:
+            return self._next_due()
+
+    # --- Running events ---
+    def run_due(self):
+        """Runs every event that is due by now. Returns how many ran."""
+        ran = 0
+        while True:
+            with self._condition:
+                event = self._pop_due(self.now())
+            if event is None:
+                return ran
+            self._run_event(event)
+            ran += 1
+
+    def advance(self, seconds):
+        """Moves game time forward by seconds, running the events on the way at their own times. Returns how many ran."""
+        if not math.isfinite(seconds):
+            raise ValueError(f"The game clock can only move forward by a finite number of seconds, not {seconds}.")
+        if seconds < 0:
+            raise ValueError("The game clock can't go back in time.")
+        target = self.now() + seconds
+        ran = 0
+        while True:
+            with self._condition:
+                event = self._pop_due(target)
+                if event is None:
+                    self._skipped += max(0.0, target - self.now())
+                    self._condition.notify() # The real-time thread may be waiting for longer than it now has to
+                    return ran
+                self._skipped += max(0.0, event[0] - self.now()) # Stop the clock at the event's own time
+            self._run_event(event) # Outside the lock: events may schedule events or wait for session locks
+            ran += 1
+
+    # --- Internals ---
+    def _next_due(self):
+        while self._heap and self._heap[0][1] not in self._pending:
+            heapq.heappop(self._heap) # Cancelled
+        return self._heap[0][0] if self._heap else None
+
+    def _pop_due(self, until):
+        due = self._next_due()
+        if due is None or due > until:
+            return None
+        event = heapq.heappop(self._heap)
+        self._pending.discard(event[1])
+        return event
+
+    @staticmethod
+    def _run_event(event):
+        _, _, callback, args = event
+        try:
+            callback(*args)
+        except Exception as e: # pylint: disable=broad-except
+            print(f"[ERROR] Game clock event {getattr(callback, '__name__', callback)} failed: {e}")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                due = self._next_due()
+                while due is None or due > self.now():
+                    self._condition.wait(None if due is None else due - self.now())
+                    due = self._next_due()
+            self.run_due()
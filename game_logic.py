@@ -39,6 +39,7 @@ def apply_character_choices_and_stats(player_obj, species_id, class_id, char_nam
     # Calculate initial derived stats (max_hp, attack_power) based on base stats and any initially equipped items (none yet)
     player_obj._recalculate_derived_stats(items_master_data)
     player_obj.hp = player_obj.max_hp # Full HP at creation
+    player_obj.mark_scene_dirty() # Inventory and equipment were replaced wholesale
 
     print(f"\nCharacter '{player_obj.name}' ({player_obj.gender} {species_info['name']} {class_info['name']}) created!")
     # The save_player_data_func now expects the player object (or its dict representation)
@@ -0,0 +1,166 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\http_cache.py
+# HTTP caching and compression for the web interface.
+# Static assets are linked as /static/app.js?v=<hash of the file>. A request that carries the file's current hash
+# is answered with a year-long immutable Cache-Control, so the browser doesn't ask again until the file changes
+# and the page links a new hash. Requests without (or with an old) hash still revalidate through Flask's ETag.
+# Read-only data APIs (species, classes) are tagged with the version of the loaded game data, so a browser that
+# already has that version gets 304 Not Modified without the response being built.
+# Responses of at least min_bytes are compressed with brotli (pip install brotli) or gzip, whichever the client
+# accepts. A compressed response that has an ETag (static files, data APIs) is kept, so it is compressed once.
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+    brotli_available = True
+except ImportError:
+    brotli = None
+    brotli_available = False
+
+DEFAULT_MIN_COMPRESS_BYTES = 1024
+DEFAULT_COMPRESSED_CACHE_ENTRIES = 64
+MAX_COMPRESS_FILE_BYTES = 8 * 1024 * 1024 # Static files bigger than this are sent as they are
+IMMUTABLE_MAX_AGE_SECONDS = 365 * 24 * 60 * 60
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5          # Per-response compression, where speed matters
+CACHED_BROTLI_QUALITY = 11  # Compressed once and reused, so the smallest output wins
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/javascript", "image/svg+xml"}
+UNCOMPRESSIBLE_MIMETYPES = {"text/event-stream"} # Compressing a stream would hold events back in the compressor
+
+
+def is_compressible(mimetype):
+    if not mimetype or mimetype in UNCOMPRESSIBLE_MIMETYPES:
+        return False
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def data_version(source_fingerprint):
+    """(ETag value, last modified timestamp) for game data loaded from files with this fingerprint.
+
+    source_fingerprint is world_bundle.compute_source_fingerprint()'s list of (path, size, mtime_ns).
+    """
+    fingerprint = source_fingerprint or []
+    digest = hashlib.sha256(json.dumps(fingerprint).encode("utf-8")).hexdigest()[:16]
+    last_modified = max((mtime_ns for _path, _size, mtime_ns in fingerprint), default=0) / 1e9
+    return digest, (last_modified or None)
+
+
+def client_has_version(request, etag, last_modified=None):
+    """True if the request's If-None-Match (or, without one, If-Modified-Since) shows the client has this version."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+
+def set_revalidate_headers(response, etag, last_modified=None):
+    """Tags a response with its version; the client may keep it but must check it is current before using it."""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = int(last_modified)
+    response.cache_control.no_cache = True
+    return response
+
+
+def set_immutable_headers(response):
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE_SECONDS
+    response.cache_control.immutable = True
+    response.cache_control.no_cache = None
+    return response
+
+
+class AssetVersions:
+    """Content hashes of the files in a static folder, recomputed when a file's size or mtime changes."""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._versions = {} # filename -> (size, mtime_ns, hash)
+        self._lock = threading.Lock()
+
+    def version(self, filename):
+        """The file's current hash, or None if it doesn't exist."""
+        filepath = os.path.join(self.static_folder, *filename.split("/"))
+        try:
+            stat_result = os.stat(filepath)
+        except OSError:
+            return None
+        cached = self._versions.get(filename)
+        if cached is not None and cached[:2] == (stat_result.st_size, stat_result.st_mtime_ns):
+            return cached[2]
+        try:
+            with open(filepath, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        except OSError:
+            return None
+        with self._lock:
+            self._versions[filename] = (stat_result.st_size, stat_result.st_mtime_ns, digest)
+        return digest
+
+
+class ResponseCompressor:
+    def __init__(self, min_bytes=DEFAULT_MIN_COMPRESS_BYTES, cache_entries=DEFAULT_COMPRESSED_CACHE_ENTRIES):
+        self.min_bytes = min_bytes
+        self.cache_entries = cache_entries
+        self._cache = OrderedDict() # (ETag, encoding) -> compressed body, least recently used first
+        self._lock = threading.Lock()
+
+    def choose_encoding(self, request):
+        accepted = request.accept_encodings
+        if brotli_available and accepted["br"]:
+            return "br"
+        if accepted["gzip"]:
+            return "gzip"
+        return None
+
+    def compress(self, request, response):
+        """Compresses response in place if it is worth it and the client accepts it. Returns the response."""
+        if not is_compressible(response.mimetype) or "Content-Encoding" in response.headers:
+            return response
+        response.vary.add("Accept-Encoding") # Caches must keep compressed and plain copies apart
+        if response.status_code != 200 or request.method == "HEAD":
+            return response
+        if response.is_streamed and not response.direct_passthrough:
+            return response # A generator (e.g. the push stream); it has to reach the client as it is produced
+        if response.content_length is not None and not self.min_bytes <= response.content_length <= MAX_COMPRESS_FILE_BYTES:
+            return response
+        encoding = self.choose_encoding(request)
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        cache_key = (etag, encoding) if etag else None
+        with self._lock:
+            body = self._cache.get(cache_key) if cache_key else None
+            if body is not None:
+                self._cache.move_to_end(cache_key)
+        if body is None:
+            response.direct_passthrough = False # Lets get_data() read a file response's body
+            data = response.get_data()
+            if len(data) < self.min_bytes:
+                return response
+            body = self._compress_bytes(data, encoding, reused=cache_key is not None)
+            if cache_key:
+                with self._lock:
+                    self._cache[cache_key] = body
+                    while len(self._cache) > self.cache_entries:
+                        self._cache.popitem(last=False)
+        else:
+            response.close() # The cached body replaces the file that would have been sent
+
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        if etag:
+            # The compressed bytes differ from the plain ones, so the tag can only be weak (as nginx does it)
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _compress_bytes(self, data, encoding, reused):
+        if encoding == "br":
+            return brotli.compress(data, quality=CACHED_BROTLI_QUALITY if reused else BROTLI_QUALITY)
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0) # mtime=0 keeps the output the same on every run
@@ -0,0 +1,168 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\metrics.py
+# In-process latency and throughput metrics for the web server.
+# Histograms use fixed buckets, so recording a sample is a handful of comparisons and no allocation.
+# The registry can be rendered in the Prometheus text exposition format or as a JSON snapshot
+# (which also includes estimated p50/p95/p99 per series).
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds; the +Inf bucket is implicit
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_SERIES_PER_METRIC = 200 # Label sets beyond this are folded into a single "other" series
+OVERFLOW_LABEL_VALUE = "other"
+REPORTED_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    __slots__ = ("bucket_bounds", "bucket_counts", "count", "sum")
+
+    def __init__(self, bucket_bounds):
+        self.bucket_bounds = bucket_bounds
+        self.bucket_counts = [0] * (len(bucket_bounds) + 1) # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.bucket_bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimates the q-quantile by linear interpolation inside the bucket it falls in (like Prometheus does)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.bucket_counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if i == len(self.bucket_bounds): # +Inf bucket: the best we can say is "above the last bound"
+                    return self.bucket_bounds[-1]
+                lower = self.bucket_bounds[i - 1] if i else 0.0
+                upper = self.bucket_bounds[i]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.bucket_bounds[-1]
+
+
+class MetricsRegistry:
+    def __init__(self, latency_buckets=DEFAULT_LATENCY_BUCKETS):
+        self.latency_buckets = tuple(latency_buckets)
+        self.started_at = time.time()
+        self._histograms = {} # name -> {"help", "label_names", "series": {label values tuple: Histogram}}
+        self._counters = {}   # name -> {"help", "label_names", "series": {label values tuple: number}}
+        self._gauges = {}     # name -> {"help", "callback"}; callback() returns the current value
+        self._lock = threading.Lock()
+
+    # --- Declaring metrics ---
+    def histogram(self, name, help_text, label_names=()):
+        self._histograms.setdefault(name, {"help": help_text, "label_names": tuple(label_names), "series": {}})
+
+    def counter(self, name, help_text, label_names=()):
+        self._counters.setdefault(name, {"help": help_text, "label_names": tuple(label_names), "series": {}})
+
+    def gauge(self, name, help_text, callback):
+        self._gauges[name] = {"help": help_text, "callback": callback}
+
+    # --- Recording ---
+    def observe(self, name, value, *label_values):
+        metric = self._histograms[name]
+        with self._lock:
+            key = self._series_key(metric, label_values)
+            histogram = metric["series"].get(key)
+            if histogram is None:
+                histogram = metric["series"][key] = Histogram(self.latency_buckets)
+            histogram.observe(value)
+
+    def increment(self, name, *label_values, amount=1):
+        metric = self._counters[name]
+        with self._lock:
+            key = self._series_key(metric, label_values)
+            metric["series"][key] = metric["series"].get(key, 0) + amount
+
+    @contextmanager
+    def timed(self, name, *label_values):
+        """Context manager that observes the duration of its body in the named histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, *label_values)
+
+    # --- Reporting ---
+    def snapshot(self):
+        """Returns every metric as plain dicts/lists, ready for JSON."""
+        with self._lock:
+            histograms = {}
+            for name, metric in self._histograms.items():
+                series_list = []
+                for label_values, histogram in metric["series"].items():
+                    series_list.append({
+                        "labels": dict(zip(metric["label_names"], label_values)),
+                        "count": histogram.count,
+                        "sum_seconds": histogram.sum,
+                        **{f"p{int(q * 100)}_seconds": histogram.quantile(q) for q in REPORTED_QUANTILES}
+                    })
+                histograms[name] = {"help": metric["help"], "series": series_list}
+            counters = {
+                name: {"help": metric["help"],
+                       "series": [{"labels": dict(zip(metric["label_names"], label_values)), "value": value}
+                                  for label_values, value in metric["series"].items()]}
+                for name, metric in self._counters.items()
+            }
+        gauges = {name: {"help": gauge["help"], "value": self._read_gauge(gauge)} for name, gauge in self._gauges.items()}
+        return {"uptime_seconds": time.time() - self.started_at, "histograms": histograms, "counters": counters, "gauges": gauges}
+
+    def render_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {metric['help']}")
+                lines.append(f"# TYPE {name} histogram")
+                for label_values, histogram in sorted(metric["series"].items()):
+                    base_labels = list(zip(metric["label_names"], label_values))
+                    cumulative = 0
+                    for bound, bucket_count in zip(self.latency_buckets + (None,), histogram.bucket_counts):
+                        cumulative += bucket_count
+                        le_value = "+Inf" if bound is None else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(base_labels + [('le', le_value)])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(base_labels)} {histogram.sum!r}")
+                    lines.append(f"{name}_count{_format_labels(base_labels)} {histogram.count}")
+            for name, metric in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {metric['help']}")
+                lines.append(f"# TYPE {name} counter")
+                for label_values, value in sorted(metric["series"].items()):
+                    lines.append(f"{name}{_format_labels(list(zip(metric['label_names'], label_values)))} {value}")
+        for name, gauge in sorted(self._gauges.items()):
+            lines.append(f"# HELP {name} {gauge['help']}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {self._read_gauge(gauge)}")
+        return "\n".join(lines) + "\n"
+
+    # --- Internals ---
+    def _series_key(self, metric, label_values):
+        key = tuple(str(value) for value in label_values)
+        if key not in metric["series"] and len(metric["series"]) >= MAX_SERIES_PER_METRIC:
+            # Keeps memory bounded when a label is fed user input (e.g. unknown commands)
+            key = tuple(OVERFLOW_LABEL_VALUE for _ in key)
+        return key
+
+    @staticmethod
+    def _read_gauge(gauge):
+        try:
+            return gauge["callback"]()
+        except Exception: # pylint: disable=broad-except
+            return float("nan")
+
+
+def _format_labels(label_pairs):
+    if not label_pairs:
+        return ""
+    escaped = (f'{key}="{_escape_label_value(value)}"' for key, value in label_pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,165 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\persistence.py
+# Background writer for character saves, so a slow disk never holds up a game response.
+# The caller captures what to write on the request path and submits a job under a key (the character's
+# directory). Jobs for the same key run one at a time in submission order; different keys are written in
+# parallel by a small pool of worker threads. A job that hasn't started yet can be superseded by a newer one
+# for the same key (coalesce=True), which is how rapid saves of a full character state collapse into one write.
+# The queue is bounded: once max_pending jobs are waiting, submit() blocks until a worker catches up.
+# submit() returns a WriteTicket; ticket.wait() blocks until the job (or the job that superseded it) has run,
+# for callers that must know the data is on disk (e.g. an explicit '!save').
+import atexit
+import threading
+from collections import deque
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 256
+
+
+class WriteTicket:
+    """Completion handle for a submitted job. result is the job's return value (None if it raised)."""
+
+    def __init__(self):
+        self.result = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Blocks until the job has run. Returns False if timeout expired first."""
+        return self._done.wait(timeout)
+
+    def _finish(self, result):
+        self.result = result
+        self._done.set()
+
+
+class _Job:
+    def __init__(self, func, args, coalesce):
+        self.func = func
+        self.args = args
+        self.coalesce = coalesce
+        self.tickets = [WriteTicket()]
+
+
+class _KeyState:
+    def __init__(self):
+        self.pending = deque() # Jobs not started yet, oldest first
+        self.running = False
+
+
+class OrderedWriteQueue:
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING, name="textland-writer"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.name = name
+        self._keys = {}         # key -> _KeyState, while the key has pending or running jobs
+        self._ready = deque()   # Keys with pending jobs and none running, in the order they became ready
+        self._pending_count = 0
+        self._condition = threading.Condition()
+        self._threads = []
+        self._closed = False
+
+    def pending_count(self):
+        return self._pending_count
+
+    def submit(self, key, func, *args, coalesce=False):
+        """Queues func(*args) to run after every job already submitted for key. Returns a WriteTicket."""
+        if self._closed:
+            # Shut down (e.g. at exit): run inline, still after anything left for this key
+            self.wait_for(key)
+            job = _Job(func, args, coalesce)
+            self._run_job(key, job)
+            return job.tickets[0]
+
+        with self._condition:
+            state = self._keys.get(key)
+            if coalesce and state is not None and state.pending and state.pending[-1].coalesce:
+                superseded = state.pending[-1]
+                superseded.func, superseded.args = func, args
+                ticket = WriteTicket()
+                superseded.tickets.append(ticket)
+                return ticket
+
+            while self._pending_count >= self.max_pending: # Backpressure: wait for the workers to catch up
+                self._condition.wait()
+            state = self._keys.get(key)
+            if state is None:
+                state = self._keys[key] = _KeyState()
+            job = _Job(func, args, coalesce)
+            state.pending.append(job)
+            self._pending_count += 1
+            if not state.running and len(state.pending) == 1:
+                self._ready.append(key)
+            self._ensure_threads()
+            self._condition.notify_all()
+        return job.tickets[0]
+
+    def wait_for(self, key, timeout=None):
+        """Blocks until every job submitted for key so far has run. Returns False if timeout expired first."""
+        with self._condition:
+            return self._condition.wait_for(lambda: key not in self._keys, timeout)
+
+    def drain(self, timeout=None):
+        """Blocks until the queue is empty. Returns False if timeout expired first."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._keys, timeout)
+
+    def close(self):
+        """Writes out everything queued. Jobs submitted afterwards run synchronously."""
+        self._closed = True
+        self.drain()
+
+    # --- Internals ---
+    def _ensure_threads(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{len(self._threads) + 1}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._ready:
+                    self._condition.wait()
+                key = self._ready.popleft()
+                state = self._keys[key]
+                job = state.pending.popleft()
+                state.running = True
+                self._pending_count -= 1
+                self._condition.notify_all() # Room for a blocked submit()
+            self._run_job(key, job)
+            with self._condition:
+                state.running = False
+                if state.pending:
+                    self._ready.append(key)
+                else:
+                    del self._keys[key]
+                self._condition.notify_all()
+
+    def _run_job(self, key, job):
+        try:
+            result = job.func(*job.args)
+        except Exception as e: # pylint: disable=broad-except
+            print(f"[ERROR] Background write for {key} failed: {e}")
+            result = None
+        for ticket in job.tickets:
+            ticket._finish(result) # pylint: disable=protected-access
+
+
+_default_queues = []
+
+
+def _close_default_queues():
+    for queue in _default_queues:
+        queue.close()
+
+
+def create_queue(**kwargs):
+    """Creates an OrderedWriteQueue that is drained automatically when the interpreter exits."""
+    queue = OrderedWriteQueue(**kwargs)
+    if not _default_queues:
+        atexit.register(_close_default_queues)
+    _default_queues.append(queue)
+    return queue
@@ -0,0 +1,174 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\push.py
+# Server-to-browser push channel using Server-Sent Events (SSE).
+# The browser keeps an EventSource open on /events and receives whatever the server publishes for its
+# session (e.g. a scene update when a harvested feature has regrown). Actions still go to /process_game_action,
+# which is the client-to-server half of the channel. SSE runs on the plain WSGI server; WebSockets would not.
+# Each session has a bounded queue. An event published with a coalesce function is merged into a queued
+# event of the same type instead of queueing behind it, so a slow client gets the latest state rather than
+# a backlog. When the queue is full anyway, the oldest event is dropped and the client is sent a "resync"
+# event first, telling it to fetch the full state.
+import itertools
+import json
+import threading
+from collections import deque
+
+DEFAULT_MAX_QUEUED_EVENTS = 64
+DEFAULT_HEARTBEAT_SECONDS = 15.0  # An SSE comment is sent this often on an idle stream so proxies don't close it
+DEFAULT_RETRY_MILLISECONDS = 3000 # How long the browser waits before reconnecting a dropped stream
+
+
+def format_event(event_id, event, data):
+    """One event in SSE wire format. json.dumps output has no newlines, so data fits on a single line."""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class PushChannel:
+    """Events waiting to be streamed to one session's browser."""
+
+    def __init__(self, max_queued):
+        self.max_queued = max_queued
+        self.queue = deque()     # (event, data), oldest first
+        self.condition = threading.Condition()
+        self.subscriber = None   # Id of the stream reading this channel; a new stream replaces the old one
+        self.needs_resync = False
+        self.closed = False
+        self.next_event_id = 1
+
+    def put(self, event, data, coalesce=None):
+        """Queues an event. Returns the number of events dropped to make room for it (0 or 1)."""
+        dropped = 0
+        with self.condition:
+            if self.closed:
+                return 0
+            if coalesce is not None:
+                for index in range(len(self.queue) - 1, -1, -1):
+                    if self.queue[index][0] == event:
+                        data = coalesce(self.queue[index][1], data)
+                        del self.queue[index]
+                        break
+            if len(self.queue) >= self.max_queued:
+                self.queue.popleft()
+                self.needs_resync = True
+                dropped = 1
+            self.queue.append((event, data))
+            self.condition.notify_all()
+        return dropped
+
+    def subscribe(self, subscriber_id):
+        with self.condition:
+            self.subscriber = subscriber_id
+            self.condition.notify_all() # Wakes a previous stream so it can see it was replaced
+
+    def unsubscribe(self, subscriber_id):
+        with self.condition:
+            if self.subscriber == subscriber_id:
+                self.subscriber = None
+
+    def take(self, subscriber_id, timeout):
+        """Waits up to timeout seconds for events. Returns SSE text ("" on timeout), or None once the stream should end."""
+        with self.condition:
+            if self._is_current(subscriber_id) and not self.queue and not self.needs_resync:
+                self.condition.wait(timeout)
+            if not self._is_current(subscriber_id):
+                return None
+            chunks = []
+            if self.needs_resync:
+                self.needs_resync = False
+                chunks.append(self._format("resync", {}))
+            while self.queue:
+                chunks.append(self._format(*self.queue.popleft()))
+            return "".join(chunks)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.queue.clear()
+            self.condition.notify_all()
+
+    def _is_current(self, subscriber_id):
+        return not self.closed and self.subscriber == subscriber_id
+
+    def _format(self, event, data):
+        event_id = self.next_event_id
+        self.next_event_id += 1
+        return format_event(event_id, event, data)
+
+
+class PushHub:
+    """Push channels of all sessions, keyed by session token."""
+
+    def __init__(self, max_queued=DEFAULT_MAX_QUEUED_EVENTS, heartbeat_seconds=DEFAULT_HEARTBEAT_SECONDS,
+                 retry_milliseconds=DEFAULT_RETRY_MILLISECONDS, max_streams=None, on_drop=None):
+        self.max_queued = max_queued
+        self.heartbeat_seconds = heartbeat_seconds
+        self.retry_milliseconds = retry_milliseconds
+        self.max_streams = max_streams # Every open stream holds a server thread; None means no limit
+        self.on_drop = on_drop # Optional callback(dropped_count) when a full queue drops events, for metrics
+        self._channels = {}    # token -> PushChannel, from a session's first stream until the session ends
+        self._subscriber_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publish(self, token, event, data, coalesce=None):
+        """Queues an event for a session's browser. Returns False if the session never opened a stream.
+
+        data must be JSON-serializable and is encoded when it is sent, so it must not be changed afterwards.
+        coalesce(queued_data, data) -> data merges the event into one of the same type that is still queued.
+        """
+        channel = self._channels.get(token)
+        if channel is None:
+            return False
+        dropped = channel.put(event, data, coalesce)
+        if dropped and self.on_drop:
+            self.on_drop(dropped)
+        return True
+
+    def has_channel(self, token):
+        return token in self._channels
+
+    def connected_count(self):
+        with self._lock:
+            return sum(1 for channel in self._channels.values() if channel.subscriber is not None)
+
+    def close(self, token):
+        """Ends a session's stream and discards its queue, e.g. when the session is evicted."""
+        with self._lock:
+            channel = self._channels.pop(token, None)
+        if channel is not None:
+            channel.close()
+
+    def close_all(self):
+        """Ends every stream, e.g. so their threads are free before the server shuts down."""
+        with self._lock:
+            channels = list(self._channels.values())
+            self._channels.clear()
+        for channel in channels:
+            channel.close()
+
+    def stream(self, token):
+        """Opens the session's stream, replacing any stream it already has. Returns a generator of SSE text.
+
+        Returns None if max_streams other sessions already have a stream open.
+        """
+        with self._lock:
+            channel = self._channels.get(token)
+            if channel is None or channel.subscriber is None:
+                open_streams = sum(1 for other in self._channels.values() if other.subscriber is not None)
+                if self.max_streams is not None and open_streams >= self.max_streams:
+                    return None
+            if channel is None:
+                channel = self._channels[token] = PushChannel(self.max_queued)
+            subscriber_id = next(self._subscriber_ids)
+            channel.subscribe(subscriber_id)
+        return self._stream_events(channel, subscriber_id)
+
+    def _stream_events(self, channel, subscriber_id):
+        try:
+            yield f"retry: {self.retry_milliseconds}\n\n"
+            while True:
+                text = channel.take(subscriber_id, self.heartbeat_seconds)
+                if text is None:
+                    return
+                yield text or ": keepalive\n\n"
+        finally:
+            # Runs when the stream ends or the client disconnects (the server closes the generator)
+            channel.unsubscribe(subscriber_id)
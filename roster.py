@@ -0,0 +1,174 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\roster.py
+# Index of the saved characters (player_data/roster.json), so the character list doesn't have to load every save.
+# Each entry holds what the character lists show: name, species and class ids, and level. Saves and deletions
+# keep it up to date, and it is only rewritten when an entry actually changes (a new character, a level up...).
+# The file is read once and kept in memory; it is re-read if another process (a --serve worker) changed it.
+# If it is missing or unreadable it is rebuilt from the saves, which can also be forced with --rebuild-roster.
+# Changes re-read, update and rewrite the file while holding an OS lock on roster.json.lock, so two processes
+# saving at the same time can't each write their own copy over the other's entry.
+import contextlib
+import json
+import os
+import threading
+
+from save_engine import SNAPSHOT_FILENAME, write_file_atomically
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError: # Windows
+    import msvcrt
+    fcntl = None
+
+ROSTER_FILENAME = "roster.json"
+ROSTER_LOCK_FILENAME = "roster.json.lock"
+ROSTER_FORMAT_VERSION = 1
+
+
+def roster_entry(state):
+    """The roster entry for a saved character state. Older saves used "species"/"class" for the ids."""
+    return {
+        "name": state.get("name"),
+        "species_id": state.get("species_id", state.get("species")),
+        "class_id": state.get("class_id", state.get("class")),
+        "level": state.get("level", 1)
+    }
+
+
+class CharacterRoster:
+    """Roster of the characters saved under player_data_dir, keyed by character directory name."""
+
+    def __init__(self, player_data_dir, load_state):
+        self.player_data_dir = player_data_dir
+        self.load_state = load_state # load_state(character_dir) -> saved state, used when rebuilding
+        self.roster_path = os.path.join(player_data_dir, ROSTER_FILENAME)
+        self._entries = None    # dir name -> entry, in the order the characters were added
+        self._file_stamp = None # (size, mtime_ns) of the roster file as last read or written
+        self._lock = threading.RLock()
+        self._file_lock_depth = 0 # How deep this process is in _file_lock(); the OS lock is taken at depth 1
+
+    def __len__(self):
+        with self._lock:
+            return len(self._current())
+
+    def entries(self):
+        """[(dir name, entry)] for every saved character. An entry is None if the save couldn't be read."""
+        with self._lock:
+            return list(self._current().items())
+
+    def update(self, dir_name, entry):
+        with self._lock:
+            entries = self._current()
+            if dir_name in entries and entries[dir_name] == entry:
+                return # Most saves don't change anything the roster shows
+            with self._file_lock():
+                entries = self._current(reread=True) # Another process may have changed it before we got the lock
+                entries[dir_name] = entry
+                self._write(entries)
+
+    def remove(self, dir_name):
+        with self._lock:
+            if dir_name not in self._current():
+                return
+            with self._file_lock():
+                entries = self._current(reread=True)
+                if dir_name in entries:
+                    del entries[dir_name]
+                    self._write(entries)
+
+    def rebuild(self):
+        """Re-reads every character save under player_data_dir. Returns the number of characters found."""
+        with self._lock:
+            entries = {}
+            if not os.path.isdir(self.player_data_dir):
+                self._entries, self._file_stamp = entries, None
+                return 0
+            with self._file_lock():
+                for dir_name in sorted(os.listdir(self.player_data_dir)):
+                    character_dir = os.path.join(self.player_data_dir, dir_name)
+                    if not os.path.exists(os.path.join(character_dir, SNAPSHOT_FILENAME)):
+                        continue
+                    try:
+                        entries[dir_name] = roster_entry(self.load_state(character_dir))
+                    except Exception as e: # pylint: disable=broad-except
+                        print(f"[WARNING] Could not read the save in {character_dir} for the roster: {e}")
+                        entries[dir_name] = None
+                self._write(entries)
+            return len(entries)
+
+    # --- Internals ---
+    def _current(self, reread=False):
+        """The roster entries, read again if the file changed (or always with reread, as the stamp has a coarse mtime)."""
+        stamp = self._stat()
+        if self._entries is not None and stamp == self._file_stamp and not reread:
+            return self._entries
+        if self._read(stamp, warn=False):
+            return self._entries
+        if not os.path.isdir(self.player_data_dir):
+            self.rebuild() # No saves at all; nothing to lock yet
+            return self._entries
+        with self._file_lock():
+            # Another process may have written the roster while we waited; rebuilding would drop its changes
+            if not self._read(self._stat(), warn=True):
+                self.rebuild()
+        return self._entries
+
+    def _read(self, stamp, warn):
+        """Loads the roster file (whose stamp is stamp) into self._entries. Returns False if it's missing or unreadable."""
+        if stamp is not None:
+            try:
+                with open(self.roster_path, "r", encoding="utf-8") as f:
+                    roster_data = json.load(f)
+                if roster_data.get("version") == ROSTER_FORMAT_VERSION:
+                    self._entries, self._file_stamp = dict(roster_data["characters"]), stamp
+                    return True
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                if warn:
+                    print(f"[WARNING] Character roster {self.roster_path} is unreadable ({e}). Rebuilding it.")
+        elif warn and self._file_stamp is not None: # Only if there was a file; a fresh install never had one
+            print(f"[WARNING] Character roster {self.roster_path} was removed. Rebuilding it.")
+        return False
+
+    def _write(self, entries):
+        # A list keeps the order characters were added in; JSON objects make no such promise to other readers
+        roster_text = json.dumps({"version": ROSTER_FORMAT_VERSION, "characters": list(entries.items())}, indent=1)
+        write_file_atomically(self.roster_path, roster_text)
+        self._entries, self._file_stamp = entries, self._stat()
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Holds the roster's lock file against other processes. Reentrant within this process (under self._lock)."""
+        self._file_lock_depth += 1
+        try:
+            if self._file_lock_depth > 1:
+                yield
+                return
+            os.makedirs(self.player_data_dir, exist_ok=True)
+            with open(os.path.join(self.player_data_dir, ROSTER_LOCK_FILENAME), "a+b") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                else:
+                    lock_file.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            pass # LK_LOCK gives up after about 10 seconds; keep waiting
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                    else:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file_lock_depth -= 1
+
+    def _stat(self):
+        try:
+            stat_result = os.stat(self.roster_path)
+        except OSError:
+            return None
+        return (stat_result.st_size, stat_result.st_mtime_ns)
@@ -0,0 +1,187 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\save_engine.py
+# Crash-safe, incremental character saves.
+# A character is stored as a compact JSON snapshot (character_creation.json) plus an append-only
+# journal (character_journal.jsonl) of the fields that changed since the snapshot.
+#  - Snapshots are written to a temp file, fsynced and renamed over the old one, so a crash never
+#    leaves a half-written character behind.
+#  - Regular saves only append the changed fields to the journal, so their cost doesn't grow with
+#    the size of the inventory or visited_locations.
+#  - Once the journal gets long it is compacted into a fresh snapshot.
+#  - Every snapshot has a generation number, and each journal entry records the generation it was written
+#    against. Loading only replays the entries of the snapshot's own generation, so entries left behind by a
+#    crash between writing a new snapshot and removing the old journal are skipped instead of reapplied.
+import json
+import os
+import threading
+
+SNAPSHOT_FILENAME = "character_creation.json"
+JOURNAL_FILENAME = "character_journal.jsonl"
+DEFAULT_COMPACT_AFTER_ENTRIES = 50
+GENERATION_FIELD = "_generation" # Snapshot key holding its generation; not part of the character state
+
+
+def _encode(value):
+    return json.dumps(value, separators=(",", ":"), sort_keys=True)
+
+
+def encode_state(state):
+    """Encodes each field of a character state. The result no longer refers to the (mutable) values in state,
+    so it can be written later, e.g. by a background thread, while the game carries on changing them."""
+    return {field: _encode(value) for field, value in state.items()}
+
+
+def _fsync_directory(directory):
+    """Makes a rename inside directory durable. Not supported on every platform (e.g. Windows), so best effort."""
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def write_file_atomically(filepath, text):
+    """Writes text to filepath via a temp file and rename, so readers only ever see the old or the new content."""
+    temp_path = f"{filepath}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, filepath)
+    _fsync_directory(os.path.dirname(filepath))
+
+
+class SaveEngine:
+    """Saves and loads character state (a JSON-serializable dict) using snapshot + delta journal files."""
+
+    def __init__(self, compact_after_entries=DEFAULT_COMPACT_AFTER_ENTRIES):
+        self.compact_after_entries = compact_after_entries
+        self._saved_fields = {}   # character_dir -> {field: encoded JSON value} as last written to disk
+        self._journal_entries = {} # character_dir -> number of journal entries since the last snapshot
+        self._generations = {}    # character_dir -> generation of the snapshot on disk
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def save(self, character_dir, state):
+        """Persists state for the character in character_dir. Returns "snapshot", "journal" or "unchanged"."""
+        return self.save_encoded(character_dir, encode_state(state))
+
+    def save_encoded(self, character_dir, encoded_fields):
+        """Like save(), for a state already passed through encode_state()."""
+        with self._lock_for(character_dir):
+            previous_fields = self._saved_fields.get(character_dir)
+            if previous_fields is None or self._journal_entries.get(character_dir, 0) >= self.compact_after_entries:
+                # Nothing known about what's on disk yet (first save this run), or the journal is due for compaction
+                self._write_snapshot(character_dir, encoded_fields)
+                return "snapshot"
+
+            changed = {field: encoded for field, encoded in encoded_fields.items() if previous_fields.get(field) != encoded}
+            removed = [field for field in previous_fields if field not in encoded_fields]
+            if not changed and not removed:
+                return "unchanged"
+
+            entry_parts = [f'"gen":{self._generations[character_dir]}', '"set":{' + ",".join(f"{json.dumps(field)}:{encoded}" for field, encoded in changed.items()) + "}"]
+            if removed:
+                entry_parts.append(f'"unset":{json.dumps(removed)}')
+            journal_line = "{" + ",".join(entry_parts) + "}\n"
+            with open(os.path.join(character_dir, JOURNAL_FILENAME), "ab") as f:
+                size_before = f.tell()
+                try:
+                    f.write(journal_line.encode("utf-8"))
+                    f.flush()
+                    os.fsync(f.fileno())
+                except OSError:
+                    self._undo_append(f, size_before, character_dir)
+                    raise
+            self._saved_fields[character_dir] = encoded_fields
+            self._journal_entries[character_dir] = self._journal_entries.get(character_dir, 0) + 1
+            return "journal"
+
+    def load(self, character_dir):
+        """Returns the saved state for the character in character_dir (snapshot + replayed journal), or None."""
+        snapshot_path = os.path.join(character_dir, SNAPSHOT_FILENAME)
+        journal_path = os.path.join(character_dir, JOURNAL_FILENAME)
+        with self._lock_for(character_dir):
+            if not os.path.exists(snapshot_path):
+                return None
+            with open(snapshot_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            generation = state.pop(GENERATION_FIELD, 0) # Snapshots from before generations count as 0
+            self._generations[character_dir] = generation
+
+            if os.path.exists(journal_path):
+                with open(journal_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            # A torn last line from a crash mid-append; everything before it is intact
+                            print(f"[WARNING] Ignoring incomplete save journal entry in {journal_path}.")
+                            break
+                        if entry.get("gen", 0) != generation:
+                            continue # Left over from an older snapshot; the current one already has it
+                        state.update(entry.get("set", {}))
+                        for field in entry.get("unset", []):
+                            state.pop(field, None)
+            return state
+
+    def compact(self, character_dir):
+        """Folds the journal into a fresh snapshot."""
+        state = self.load(character_dir)
+        if state is not None:
+            with self._lock_for(character_dir):
+                self._write_snapshot(character_dir, encode_state(state))
+
+    def forget(self, character_dir):
+        """Drops cached state for a character, e.g. after its files were deleted."""
+        with self._lock_for(character_dir):
+            self._saved_fields.pop(character_dir, None)
+            self._journal_entries.pop(character_dir, None)
+            self._generations.pop(character_dir, None)
+
+    def _write_snapshot(self, character_dir, encoded_fields):
+        generation = self._current_generation(character_dir) + 1
+        snapshot_parts = [f"{json.dumps(GENERATION_FIELD)}:{generation}"]
+        snapshot_parts.extend(f"{json.dumps(field)}:{encoded}" for field, encoded in encoded_fields.items())
+        write_file_atomically(os.path.join(character_dir, SNAPSHOT_FILENAME), "{" + ",".join(snapshot_parts) + "}")
+        self._generations[character_dir] = generation
+        # The snapshot now contains everything the journal did. Replaying the old entries on top of it would
+        # revert fields changed since they were written, so if a crash leaves the journal behind, load() skips
+        # its entries by their (older) generation.
+        journal_path = os.path.join(character_dir, JOURNAL_FILENAME)
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+        self._saved_fields[character_dir] = encoded_fields
+        self._journal_entries[character_dir] = 0
+
+    def _undo_append(self, journal_file, size_before, character_dir):
+        """Cuts a failed append off the journal. load() stops at the first unreadable line, so a torn line left in
+        place would hide every entry appended after it. If it can't be cut off, the next save writes a snapshot."""
+        try:
+            journal_file.truncate(size_before)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        except OSError:
+            self._saved_fields.pop(character_dir, None)
+
+    def _current_generation(self, character_dir):
+        """Generation of the snapshot on disk (0 if there is none), read from the file the first time."""
+        if character_dir not in self._generations:
+            generation = 0
+            try:
+                with open(os.path.join(character_dir, SNAPSHOT_FILENAME), "r", encoding="utf-8") as f:
+                    generation = json.load(f).get(GENERATION_FIELD, 0)
+            except (OSError, ValueError):
+                pass # No readable snapshot: anything left in the journal is older than the next one anyway
+            self._generations[character_dir] = generation
+        return self._generations[character_dir]
+
+    def _lock_for(self, character_dir):
+        with self._locks_guard:
+            if character_dir not in self._locks:
+                self._locks[character_dir] = threading.RLock()
+            return self._locks[character_dir]
@@ -0,0 +1,118 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\scene.py
+# Per-session cache for the sections of the scene payload sent to the browser.
+# Every web response carries the whole scene (equipment, inventory, room, zone map...), but a typical
+# action only changes one or two of those. Each section is cached together with the key it was built
+# for (e.g. the location id) and is only rebuilt when that key changes or the section is flagged dirty.
+# Dirty flags come from the Player (equipping, moving, inventory changes; see Player.mark_scene_dirty)
+# and from the WorldState (every change to a location is recorded in world.dirty_locations).
+# Cached section values are shared between responses and must be treated as read-only.
+#
+# Responses are delta-encoded: each scene sent gets a version number and the client echoes the version it
+# holds with its next request. If that is the last version sent, only the top-level fields that changed
+# are sent (a patch); otherwise (first request, reload, lost response, second tab) the full scene is.
+# Scenes pushed over the push channel (push.py) take part in the same version sequence.
+
+ALL_SECTIONS = "all" # Player.mark_scene_dirty() without arguments flags every section
+ALWAYS_SENT_FIELDS = ("message",) # Per-action output; sent even when it repeats the previous one
+
+
+class SceneCache:
+    def __init__(self):
+        self._sections = {} # section name -> (key, value)
+        self._player = None # The Player and WorldState the cached sections were built from
+        self._world = None
+        self.hits = 0
+        self.builds = 0
+        self.version = 0        # Version of the last scene sent to the client
+        self._sent_fields = None # Top-level fields of that scene, to diff the next one against
+
+    def sync(self, player, world):
+        """Drops the sections whose inputs changed since the last response. Call before reading sections."""
+        if player is not self._player or world is not self._world:
+            # Character loaded or world reloaded: nothing cached is valid any more
+            self._sections.clear()
+            self._player, self._world = player, world
+            player.scene_dirty.clear()
+            world.pop_dirty_locations()
+            return
+
+        if ALL_SECTIONS in player.scene_dirty:
+            self._sections.clear()
+        else:
+            for section_name in player.scene_dirty:
+                self._sections.pop(section_name, None)
+        player.scene_dirty.clear()
+
+        changed_locations = world.pop_dirty_locations()
+        if changed_locations:
+            if player.current_location_id in changed_locations:
+                self._sections.pop("room", None)
+            if not changed_locations.isdisjoint(player.visited_locations):
+                self._sections.pop("map", None) # The map shows NPCs and features of visited locations
+
+    def section(self, name, key, build):
+        """Returns the cached value of a section if it was built for key, otherwise build() (and caches it)."""
+        cached = self._sections.get(name)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            return cached[1]
+        value = build()
+        self._sections[name] = (key, value)
+        self.builds += 1
+        return value
+
+    def encode(self, payload, client_version=None):
+        """Returns the response body for a scene: a patch against client_version if possible, else the full scene.
+
+        Patches carry "scene_patch": true, the fields that changed, and "removed_fields" for fields that are gone.
+        """
+        previous_fields = self._sent_fields if client_version is not None and client_version == self.version else None
+        self.version += 1
+        self._sent_fields = dict(payload)
+        if previous_fields is None:
+            return {**payload, "scene_version": self.version, "scene_patch": False}
+
+        response = {
+            field: value for field, value in payload.items()
+            if field in ALWAYS_SENT_FIELDS or field not in previous_fields or not _same_value(previous_fields[field], value)
+        }
+        removed_fields = [field for field in previous_fields if field not in payload]
+        if removed_fields:
+            response["removed_fields"] = removed_fields
+        response.update({"scene_version": self.version, "scene_patch": True, "base_version": client_version})
+        return response
+
+    def invalidate(self, name=None):
+        if name is None:
+            self._sections.clear()
+        else:
+            self._sections.pop(name, None)
+
+
+def _same_value(old, new):
+    # Unchanged sections are the very same cached objects, so most comparisons stop at the identity check
+    return old is new or old == new
+
+
+def merge_scene_responses(older, newer):
+    """Combines two encoded scene responses still waiting to be pushed into one (see push.PushHub.publish).
+
+    The result takes a client from older's base to newer's version, so dropping older loses nothing.
+    """
+    if not newer["scene_patch"] or newer["base_version"] != older["scene_version"]:
+        return newer # A full scene (or one that doesn't follow older) replaces it outright
+    removed_fields = set(newer.get("removed_fields", ()))
+    merged = {field: value for field, value in older.items() if field not in removed_fields}
+    merged.update(newer)
+    merged["scene_patch"] = older["scene_patch"]
+    if older["scene_patch"]:
+        merged["base_version"] = older["base_version"]
+        removed_fields |= set(older.get("removed_fields", ())) - newer.keys()
+        if removed_fields:
+            merged["removed_fields"] = sorted(removed_fields)
+        else:
+            merged.pop("removed_fields", None)
+    else:
+        merged.pop("base_version", None)
+        merged.pop("removed_fields", None)
+    return merged
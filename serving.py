@@ -0,0 +1,148 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\serving.py
+# Production serving mode for the web interface (--serve).
+# The app runs under waitress (pip install waitress) with a fixed pool of request threads, instead of Flask's
+# development server. Without waitress it falls back to Werkzeug's threaded server, which has no thread limit.
+# Game sessions live in the memory of the process that created them, so several workers can't share one port:
+# with --workers N, worker i is a separate process serving on port + i, and the load balancer must keep each
+# client (its textland_session cookie) on the same worker.
+# SIGTERM or Ctrl+C shuts a worker down gracefully: it stops taking requests, lets running ones finish and
+# then calls its on_shutdown callback (which flushes saves and event logs).
+import os
+import signal
+import subprocess
+import sys
+import time
+
+try:
+    import waitress
+    waitress_available = True
+except ImportError:
+    waitress = None
+    waitress_available = False
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5000
+DEFAULT_THREADS = 16
+DEFAULT_WORKERS = 1
+DEFAULT_CONNECTION_LIMIT = 1000
+WORKER_RESTART_DELAY_SECONDS = 1.0
+
+
+def option_value(argv, name, default, convert=str):
+    """The value given for a command-line option as '--name value' or '--name=value', or default."""
+    for index, arg in enumerate(argv):
+        if arg == name and index + 1 < len(argv):
+            return convert(argv[index + 1])
+        if arg.startswith(name + "="):
+            return convert(arg[len(name) + 1:])
+    return default
+
+
+def without_option(argv, name):
+    """argv with '--name value' / '--name=value' removed."""
+    result = []
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+        elif arg == name:
+            skip_next = True
+        elif not arg.startswith(name + "="):
+            result.append(arg)
+    return result
+
+
+class ShutdownRequested(SystemExit):
+    """Raised in the main thread by the shutdown signal handler; servers stop their loop on SystemExit."""
+
+
+def _shutdown_signals():
+    if hasattr(signal, "SIGBREAK"): # Windows: how the worker supervisor asks a worker to stop
+        return (signal.SIGTERM, signal.SIGINT, signal.SIGBREAK)
+    return (signal.SIGTERM, signal.SIGINT)
+
+
+def _install_shutdown_handlers(before_shutdown):
+    def handle_signal(signum, frame):
+        for shutdown_signal in _shutdown_signals():
+            signal.signal(shutdown_signal, signal.SIG_IGN) # Ctrl+C reaches workers and supervisor alike; stop only once
+        print(f"[Serve] Received signal {signum}, shutting down...")
+        before_shutdown()
+        raise ShutdownRequested(0)
+    for shutdown_signal in _shutdown_signals():
+        signal.signal(shutdown_signal, handle_signal)
+
+
+def serve(app, host=DEFAULT_HOST, port=DEFAULT_PORT, threads=DEFAULT_THREADS,
+          connection_limit=DEFAULT_CONNECTION_LIMIT, before_shutdown=None, on_shutdown=None):
+    """Serves app until a shutdown signal arrives.
+
+    before_shutdown() runs as soon as the signal arrives (e.g. to end long-lived streams so their threads free up);
+    on_shutdown() runs once the server has stopped and running requests have finished.
+    """
+    _install_shutdown_handlers(before_shutdown or (lambda: None))
+    try:
+        if waitress_available:
+            print(f"[Serve] Serving on http://{host}:{port}/ with {threads} threads (pid {os.getpid()}).")
+            server = waitress.create_server(app, host=host, port=port, threads=threads,
+                                            connection_limit=connection_limit, ident="textland")
+            try:
+                server.run() # Returns after a signal, once running requests are done (waitress waits up to 5s)
+            finally:
+                server.close()
+        else:
+            from werkzeug.serving import make_server
+            print("[Serve] waitress is not installed (pip install waitress); using Werkzeug's threaded server, "
+                  "which starts a thread per request without limit.")
+            print(f"[Serve] Serving on http://{host}:{port}/ (pid {os.getpid()}).")
+            server = make_server(host, port, app, threaded=True)
+            try:
+                server.serve_forever()
+            finally:
+                server.server_close()
+    except ShutdownRequested:
+        pass
+    finally:
+        if on_shutdown:
+            on_shutdown()
+        print("[Serve] Server stopped.")
+
+
+def run_workers(script_path, argv, workers, port):
+    """Runs `workers` copies of the server (script_path with argv) on port, port + 1, ... and restarts any that die.
+
+    Returns once every worker has exited after a shutdown signal.
+    """
+    worker_argv = without_option(without_option(argv, "--workers"), "--port")
+    popen_options = {}
+    if os.name == "nt":
+        popen_options["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP # So each worker can be sent CTRL_BREAK
+
+    def start_worker(worker_port):
+        command = [sys.executable, script_path] + worker_argv + ["--workers", "1", "--port", str(worker_port)]
+        return subprocess.Popen(command, **popen_options)
+
+    processes = {worker_port: start_worker(worker_port) for worker_port in range(port, port + workers)}
+    print(f"[Serve] Started {workers} workers on ports {port}-{port + workers - 1}. "
+          "Route each textland_session cookie to a single worker.")
+    shutting_down = []
+
+    def handle_signal(signum, frame):
+        shutting_down.append(signum)
+    for shutdown_signal in _shutdown_signals():
+        signal.signal(shutdown_signal, handle_signal)
+
+    while not shutting_down:
+        time.sleep(WORKER_RESTART_DELAY_SECONDS)
+        for worker_port, process in list(processes.items()):
+            if process.poll() is not None and not shutting_down:
+                print(f"[Serve] Worker on port {worker_port} exited with code {process.returncode}; restarting it.")
+                processes[worker_port] = start_worker(worker_port)
+
+    print("[Serve] Stopping workers...")
+    for process in processes.values():
+        if process.poll() is None:
+            process.send_signal(signal.CTRL_BREAK_EVENT if os.name == "nt" else signal.SIGTERM)
+    for process in processes.values():
+        process.wait()
+    print("[Serve] All workers stopped.")
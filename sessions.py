@@ -0,0 +1,169 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\sessions.py
+# Per-session game state for the web server.
+# Every browser session gets its own Player plus its own view of the world state,
+# so one server process can host many players without them overwriting each other.
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from scene import SceneCache
+
+DEFAULT_MAX_SESSIONS = 500
+DEFAULT_IDLE_TIMEOUT_SECONDS = 30 * 60 # Sessions idle for longer than this are evicted
+
+
+class GameSession:
+    def __init__(self, token, player, world):
+        self.token = token
+        self.player = player
+        self.world = world # This session's view of the mutable world state (locations, NPCs, features)
+        self.scene = SceneCache() # Cached sections of the scene payload sent to the browser
+        self.created_at = time.time()
+        self.last_active = self.created_at
+        # Requests for the same session are serialized; different sessions run in parallel
+        self.lock = threading.RLock()
+
+    def touch(self):
+        self.last_active = time.time()
+
+    def idle_seconds(self, now=None):
+        return (now if now is not None else time.time()) - self.last_active
+
+
+class SessionManager:
+    """Registry of live game sessions keyed by session token, with idle eviction and a size cap."""
+
+    def __init__(self, player_factory, world_factory, max_sessions=DEFAULT_MAX_SESSIONS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT_SECONDS, on_evict=None):
+        self.player_factory = player_factory
+        self.world_factory = world_factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict # Optional callback(session), e.g. to flush logs before a session is dropped
+        self._sessions = OrderedDict() # token -> GameSession, least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, token):
+        return token in self._sessions
+
+    def create_session(self):
+        """Creates and registers a new session. Returns None if the live session cap is reached."""
+        self.evict_idle_sessions()
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                return None
+            token = uuid.uuid4().hex
+            session = GameSession(token, self.player_factory(), self.world_factory())
+            self._sessions[token] = session
+        return session
+
+    def get_session(self, token):
+        """Returns the live session for a token (marking it as recently used), or None."""
+        if not token:
+            return None
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            if session.idle_seconds() > self.idle_timeout:
+                del self._sessions[token]
+                expired = session
+                session = None
+            else:
+                session.touch()
+                self._sessions.move_to_end(token)
+                expired = None
+        if expired is not None:
+            self._notify_evicted(expired)
+        return session
+
+    def end_session(self, token):
+        with self._lock:
+            session = self._sessions.pop(token, None)
+        if session is not None:
+            self._notify_evicted(session)
+        return session is not None
+
+    def evict_idle_sessions(self, now=None):
+        """Drops every session idle for longer than idle_timeout. Returns the number evicted."""
+        now = now if now is not None else time.time()
+        evicted = []
+        with self._lock:
+            # Sessions are kept in LRU order, so we can stop at the first one that is still fresh
+            while self._sessions:
+                token, session = next(iter(self._sessions.items()))
+                if session.idle_seconds(now) <= self.idle_timeout:
+                    break
+                del self._sessions[token]
+                evicted.append(session)
+        for session in evicted:
+            self._notify_evicted(session)
+        return len(evicted)
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def _notify_evicted(self, session):
+        if self.on_evict:
+            try:
+                self.on_evict(session)
+            except Exception as e: # pylint: disable=broad-except
+                print(f"[ERROR] Session eviction callback failed for session {session.token}: {e}")
+
+
+# --- Binding the active session to the current thread ---
+# Game functions keep using the module-level `player`/`locations` names; those are proxies
+# that resolve to the session bound to the thread handling the current request.
+# When no session is bound (terminal play), the default session is used.
+_thread_state = threading.local()
+default_session = GameSession("terminal", None, None)
+
+
+def bind_session(session):
+    _thread_state.session = session
+
+
+def unbind_session():
+    _thread_state.session = None
+
+
+def current_session():
+    return getattr(_thread_state, "session", None) or default_session
+
+
+class SessionPlayerProxy:
+    """Stands in for the module-level `player` and forwards everything to the current session's Player."""
+
+    def __getattr__(self, name):
+        return getattr(current_session().player, name)
+
+    def __setattr__(self, name, value):
+        setattr(current_session().player, name, value)
+
+    def __delattr__(self, name):
+        delattr(current_session().player, name)
+
+
+class SessionWorldProxy:
+    """Stands in for the module-level `locations` and forwards to the current session's WorldState."""
+
+    def __getitem__(self, key):
+        return current_session().world[key]
+
+    def __contains__(self, key):
+        return key in current_session().world
+
+    def __iter__(self):
+        return iter(current_session().world)
+
+    def __len__(self):
+        return len(current_session().world)
+
+    def __getattr__(self, name):
+        # get(), items(), keys(), values() and friends
+        return getattr(current_session().world, name)
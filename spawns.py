@@ -0,0 +1,63 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\spawns.py
+# NPC respawning. An NPC a player defeats is gone from that player's world (see world_state.py) until its
+# respawn delay has passed; then the location's NPC is back as spawned from its template, at full HP and stock.
+# data/locations.json can give an NPC "respawn_seconds" (0 or false: never comes back); hostile NPCs without
+# one use the game-wide default (TEXTLAND_NPC_RESPAWN_SECONDS), and other NPCs don't come back.
+# Pending respawns wait in a RespawnScheduler, a heap ordered by due time: scheduling is O(log n), and checking
+# for due respawns only looks at the earliest one, so it costs O(1) when nothing is due, however many NPCs are
+# waiting. Nothing has to scan the locations.
+import heapq
+import itertools
+import time
+
+DEFAULT_RESPAWN_SECONDS = 300
+
+
+def respawn_delay(npc_template, default_seconds=DEFAULT_RESPAWN_SECONDS):
+    """Seconds until a defeated NPC of this template respawns, or None if it never does."""
+    seconds = npc_template.respawn_seconds
+    if seconds is None:
+        seconds = default_seconds if npc_template.hostile else 0
+    return seconds if seconds and seconds > 0 else None
+
+
+class RespawnScheduler:
+    """Respawns due at a time on clock(), keyed by (location id, NPC id). Scheduling a key again replaces it."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []    # (due time, sequence, key); entries that were cancelled or replaced stay until popped
+        self._pending = {} # key -> (due time, sequence) of its live heap entry
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def schedule(self, loc_id, npc_id, delay_seconds):
+        """Schedules (or reschedules) a respawn. Returns the time on clock() it is due at."""
+        key = (loc_id, npc_id)
+        entry = (self.clock() + delay_seconds, next(self._sequence))
+        self._pending[key] = entry
+        heapq.heappush(self._heap, entry + (key,))
+        return entry[0]
+
+    def cancel(self, loc_id, npc_id):
+        self._pending.pop((loc_id, npc_id), None)
+
+    def seconds_until(self, loc_id, npc_id):
+        """Seconds left until this NPC respawns, or None if it isn't waiting to."""
+        entry = self._pending.get((loc_id, npc_id))
+        return None if entry is None else max(0.0, entry[0] - self.clock())
+
+    def pop_due(self):
+        """[(loc_id, npc_id)] whose respawn time has come, earliest first."""
+        if not self._heap or self._heap[0][0] > self.clock():
+            return [] # The common case: one comparison
+        now = self.clock()
+        due_keys = []
+        while self._heap and self._heap[0][0] <= now:
+            due, sequence, key = heapq.heappop(self._heap)
+            if self._pending.get(key) == (due, sequence):
+                del self._pending[key]
+                due_keys.append(key)
+        return due_keys
@@ -7,6 +7,12 @@ let commandNexusSetup = false; // Flag to ensure Command Nexus setup runs only o
 let gameIsActiveForInput = false; // True when game interface is shown
 const SESSION_STORAGE_GAME_ACTIVE_KEY = 'textRpgGameSessionActive';
 const SESSION_STORAGE_CHAR_NAME_KEY = 'textRpgCharacterName';
+// Versioned scene state: the server answers actions with a patch against the scene version we hold (see scene.py)
+let sceneState = null;
+let sceneVersion = null;
+const SCENE_PROTOCOL_FIELDS = ['scene_version', 'scene_patch', 'base_version', 'removed_fields'];
+// Server push channel (Server-Sent Events on /events, see push.py); actions still go through performAction
+let pushChannel = null;
 
  // Centralized pause/resume logic
 function togglePauseGame() {
@@ -348,13 +354,14 @@ async function submitCharacterCreation(predefinedName = null, predefinedGender =
         discoveredDeadEnds = {}; // Reset for new character
         gameInterface.style.display = 'block';
         outputElement.innerHTML = ''; // Clear "creating character" message
-        displaySceneData(initialSceneData, "Character created! Your adventure begins.");
+        displaySceneData(applySceneResponse(initialSceneData).scene, "Character created! Your adventure begins.");
         document.getElementById('settings-button-container').style.display = 'block';
         sessionStorage.setItem(SESSION_STORAGE_GAME_ACTIVE_KEY, 'true');
         sessionStorage.setItem(SESSION_STORAGE_CHAR_NAME_KEY, charName);
         gameIsActiveForInput = true;
         setupCommandNexus(); // Setup Command Nexus when game starts
         setupVPad(); // Setup VPad
+        connectPushChannel();
     } catch (error) {
         const errorMessage = `Error creating character: ${error.message || error}`;
         console.error(errorMessage, error);
@@ -414,13 +421,14 @@ async function handleLoadCharacter(characterName) {
         discoveredDeadEnds = {}; // Reset for loaded character
         gameInterface.style.display = 'block';
         outputElement.innerHTML = ''; 
-        displaySceneData(loadedSceneData, `Loaded character: ${characterName}.`);
+        displaySceneData(applySceneResponse(loadedSceneData).scene, `Loaded character: ${characterName}.`);
         document.getElementById('settings-button-container').style.display = 'block';
         sessionStorage.setItem(SESSION_STORAGE_GAME_ACTIVE_KEY, 'true');
         sessionStorage.setItem(SESSION_STORAGE_CHAR_NAME_KEY, characterName);
         gameIsActiveForInput = true;
         setupCommandNexus(); // Setup Command Nexus when game loads
         setupVPad(); // Setup VPad
+        connectPushChannel();
     } catch (error) {
         const errorMessage = `Error loading character '${characterName}': ${error.message || error}`;
         console.error(errorMessage, error);
@@ -433,6 +441,9 @@ function goToMainMenu() {
     closeModal(); // Close any open modal like settings or pause
     sessionStorage.removeItem(SESSION_STORAGE_GAME_ACTIVE_KEY);
     sessionStorage.removeItem(SESSION_STORAGE_CHAR_NAME_KEY);
+    sceneState = null; // The next character starts from a full scene
+    sceneVersion = null;
+    disconnectPushChannel();
     // Optionally, tell the server to clear the active player state if necessary (e.g., via an API call)
     showInitialCharacterScreen();
 }
@@ -461,13 +472,14 @@ async function attemptResumeSession(characterName) {
         discoveredDeadEnds = {}; // Reset for resumed session
         gameInterface.style.display = 'block';
         outputElement.innerHTML = ''; 
-        displaySceneData(resumedSceneData, `Session resumed for ${characterName}.`);
+        displaySceneData(applySceneResponse(resumedSceneData).scene, `Session resumed for ${characterName}.`);
         document.getElementById('settings-button-container').style.display = 'block';
         sessionStorage.setItem(SESSION_STORAGE_GAME_ACTIVE_KEY, 'true'); // Re-affirm session
         sessionStorage.setItem(SESSION_STORAGE_CHAR_NAME_KEY, characterName); // Re-affirm character
         gameIsActiveForInput = true;
         setupCommandNexus(); // Setup Command Nexus when session resumes
         setupVPad(); // Setup VPad
+        connectPushChannel();
 
     } catch (error) {
         console.error("Error resuming session directly, trying full load:", error);
@@ -493,11 +505,17 @@ async function performAction(actionString) {
         const serverResponse = await fetch('/process_game_action', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json', },
-            body: JSON.stringify({ action: actionString }),
+            body: JSON.stringify({ action: actionString, scene_version: sceneVersion }),
         });
         if (!serverResponse.ok) throw new Error(`HTTP error! status: ${serverResponse.status}`);
         const data = await serverResponse.json();
-        displaySceneData(data, actionString); // Use a helper to display
+        const applied = applySceneResponse(data);
+        if (applied) {
+            displaySceneData(applied.scene, actionString, applied.changedFields); // Use a helper to display
+        } else {
+            await refreshScene({ action: actionString, message: data.message }); // Stale patch: still show what the action did
+        }
+        connectPushChannel(); // Reopens the push channel if the server turned it away earlier
     } catch (error) {
         let userMessage = `Error: ${error.message || "An unknown error occurred."}`;
         if (error instanceof TypeError && error.message.toLowerCase().includes('failed to fetch')) {
@@ -520,6 +538,115 @@ async function performAction(actionString) {
     outputElement.scrollTop = outputElement.scrollHeight;
 }
 
+// Runs several actions in one request (/process_game_actions). The server stops at the first action that fails
+// or that starts a fight or conversation, and answers with every action's message and the resulting scene.
+async function performActions(actionStrings) {
+    if (gameIsPaused) {
+        console.log("Game is paused. Actions not sent.");
+        return;
+    }
+    const outputElement = document.getElementById('game-output');
+    try {
+        const serverResponse = await fetch('/process_game_actions', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ actions: actionStrings, scene_version: sceneVersion }),
+        });
+        if (!serverResponse.ok) throw new Error(`HTTP error! status: ${serverResponse.status}`);
+        const data = await serverResponse.json();
+        const results = data.action_results || [];
+        const lastRun = results.length ? results[results.length - 1].action : actionStrings[actionStrings.length - 1];
+        const applied = applySceneResponse(data);
+        if (applied) {
+            displaySceneData(applied.scene, lastRun, applied.changedFields);
+        } else {
+            await refreshScene({ action: lastRun, message: data.message }); // Stale patch: still show what the actions did
+        }
+        connectPushChannel();
+    } catch (error) {
+        console.error("Error in performActions:", error);
+        appendMessageToOutput(`Error: ${error.message || "An unknown error occurred."}`, 'error-message');
+    }
+    if (outputElement) outputElement.scrollTop = outputElement.scrollHeight;
+}
+
+// Merges a scene response into sceneState. Returns {scene, changedFields}, where changedFields is null
+// for a full scene (everything must be rendered), or null if the response was a stale patch.
+function applySceneResponse(data) {
+    if (data.scene_patch) {
+        if (!sceneState || data.base_version !== sceneVersion) {
+            // A patch for a scene we no longer hold (e.g. overlapping actions); the next request gets a full scene
+            console.warn("Discarding scene patch for version", data.base_version, "- holding", sceneVersion);
+            sceneVersion = null;
+            return null;
+        }
+        const changedFields = new Set();
+        for (const field in data) {
+            if (SCENE_PROTOCOL_FIELDS.includes(field)) continue;
+            sceneState[field] = data[field];
+            changedFields.add(field);
+        }
+        (data.removed_fields || []).forEach(field => {
+            delete sceneState[field];
+            changedFields.add(field);
+        });
+        sceneVersion = data.scene_version;
+        return { scene: sceneState, changedFields: changedFields };
+    }
+    sceneState = Object.assign({}, data);
+    SCENE_PROTOCOL_FIELDS.forEach(field => delete sceneState[field]);
+    sceneVersion = data.scene_version !== undefined ? data.scene_version : null; // Unversioned replies (errors) force a full scene next
+    return { scene: sceneState, changedFields: null };
+}
+
+function connectPushChannel() {
+    if (pushChannel || typeof EventSource === 'undefined') return;
+    pushChannel = new EventSource('/events'); // Reconnects by itself if the connection drops
+    pushChannel.addEventListener('scene', event => {
+        const applied = applySceneResponse(JSON.parse(event.data));
+        if (applied) {
+            displaySceneData(applied.scene, null, applied.changedFields);
+        } else {
+            refreshScene(); // Pushed against a scene we don't hold (e.g. it crossed an action's response)
+        }
+    });
+    pushChannel.addEventListener('resync', () => refreshScene()); // The server dropped events for us
+    pushChannel.onerror = () => {
+        // EventSource gives up after an error status (e.g. 503 when the server has too many streams open)
+        if (pushChannel && pushChannel.readyState === EventSource.CLOSED) pushChannel = null;
+    };
+}
+
+function disconnectPushChannel() {
+    if (pushChannel) {
+        pushChannel.close();
+        pushChannel = null;
+    }
+}
+
+// Brings sceneState up to date with the server without performing an action. actionResult ({action, message})
+// is shown along with the fresh scene when it replaces an action's reply that couldn't be applied (a stale patch).
+async function refreshScene(actionResult = null) {
+    try {
+        const response = await fetch('/api/scene', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ scene_version: sceneVersion })
+        });
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const applied = applySceneResponse(await response.json());
+        if (applied) {
+            if (actionResult) applied.scene.message = actionResult.message;
+            displaySceneData(applied.scene, actionResult ? actionResult.action : null, applied.changedFields);
+        } else if (actionResult && actionResult.message) {
+            appendMessageToOutput(actionResult.message);
+        }
+    } catch (error) {
+        console.error("Error refreshing scene:", error);
+        if (actionResult && actionResult.message) appendMessageToOutput(actionResult.message);
+    }
+}
+
 async function toggleWorldMapModal() {
     const existingModal = document.getElementById('world-map-modal-overlay');
     if (existingModal) {
@@ -979,13 +1106,15 @@ function updateInventoryModalComponent(data, actionStringEcho) {
                 const isChecked = this.checked;
                 // Send action to backend to update the persistent player setting
                 // Example action: "set_player_preference <preference_name> <value>"
-                performAction(`set_player_preference auto_equip_from_inventory_panel_enabled ${isChecked}`);
+                const preferenceAction = `set_player_preference auto_equip_from_inventory_panel_enabled ${isChecked}`;
 
                 if (isChecked) {
-                    // If now checked, also perform the immediate auto-equip attempt from current inventory
+                    // If now checked, also perform the immediate auto-equip attempt from current inventory, in the same request
 
                     console.log("Auto-equip checkbox checked. Sending 'auto_equip_inventory' action.");
-                    performAction('auto_equip_inventory');
+                    performActions([preferenceAction, 'auto_equip_inventory']);
+                } else {
+                    performAction(preferenceAction);
                 }
             });
         }
@@ -1157,14 +1286,27 @@ function setupCommandNexus() {
 
 // --- End of Top-Level Component Update Functions ---
 
-function displaySceneData(data, actionStringEcho = null) {
+// Scene fields each panel is rendered from; after a patch only panels whose fields changed are redrawn
+const HEADER_FIELDS = ['location_name', 'player_name', 'player_level', 'player_xp', 'player_xp_to_next_level', 'player_coins'];
+const CHARACTER_PANEL_FIELDS = ['player_name', 'player_class_name', 'player_species_name', 'player_level', 'player_xp',
+    'player_xp_to_next_level', 'player_hp', 'player_max_hp', 'player_attack_power', 'player_coins', 'player_equipment'];
+const MAP_FIELDS = ['map_type', 'city_map_data', 'player_city_x', 'player_city_y', 'current_zone_map_data'];
+
+function displaySceneData(data, actionStringEcho = null, changedFields = null) {
     console.trace("displaySceneData called");
-    // Deep clone for logging to avoid issues if data is modified elsewhere by reference
-    console.log("Data received by displaySceneData:", JSON.parse(JSON.stringify(data))); 
+    if (changedFields) {
+        console.log("Scene fields changed:", Array.from(changedFields));
+    } else {
+        // Deep clone for logging to avoid issues if data is modified elsewhere by reference
+        console.log("Data received by displaySceneData:", JSON.parse(JSON.stringify(data))); 
+    }
+    const anyChanged = (fields) => !changedFields || fields.some(field => changedFields.has(field));
     const outputElement = document.getElementById('game-output');
 
     // Call the core component update functions
+    const deadEndCountBefore = Object.keys(discoveredDeadEnds).length;
     updateGameOutputComponent(data, actionStringEcho);
+    const newDeadEndFound = Object.keys(discoveredDeadEnds).length !== deadEndCountBefore; // Drawn on the zone map
 
     // If the inventory modal ("Backpack") is already open, refresh its grid content
     // This logic is already present, ensuring it uses the latest data.
@@ -1172,33 +1314,40 @@ function displaySceneData(data, actionStringEcho = null) {
     if (inventoryModal) {
         const modalTitleElement = inventoryModal.querySelector('#custom-modal-content h3');
         // Check if the modal is the Backpack modal AND if inventory_list data is available
-        if (modalTitleElement && modalTitleElement.textContent === "Backpack" && data.inventory_list) {
+        if (modalTitleElement && modalTitleElement.textContent === "Backpack" && data.inventory_list && anyChanged(['inventory_list'])) {
             console.log("Inventory modal is open. Refreshing grid.");
             renderOrUpdateModalBackpackGrid(data.inventory_list);
         }
     }
 
     // Call the component function to update the Dynamic Header
-    updateDynamicHeaderComponent(data); // Pass the whole data object, component will pick what it needs
+    if (anyChanged(HEADER_FIELDS)) updateDynamicHeaderComponent(data); // Pass the whole data object, component will pick what it needs
 
     // Call the component function to update the Character Panel
-    updateCharacterPanelComponent(data); 
+    if (anyChanged(CHARACTER_PANEL_FIELDS)) updateCharacterPanelComponent(data); 
 
     // Call the component functions to update Feature and Item panels
-    updateFeatureInteractionsComponent(data.interactable_features);
-    updateRoomItemsComponent(data.room_items);
+    if (anyChanged(['interactable_features'])) updateFeatureInteractionsComponent(data.interactable_features);
+    if (anyChanged(['room_items'])) updateRoomItemsComponent(data.room_items);
 
     // Call component functions for action panels in desired visual order (top to bottom)
-    updateExitButtonsComponent(data.available_exits); // Handles dynamic "Go" buttons
-    updateActionButtonsComponent(data.available_actions); // For general actions like "Enter City", called AFTER exit buttons
+    if (anyChanged(['available_exits'])) updateExitButtonsComponent(data.available_exits); // Handles dynamic "Go" buttons
+    if (anyChanged(['available_actions'])) updateActionButtonsComponent(data.available_actions); // For general actions like "Enter City", called AFTER exit buttons
 
-    updateNPCInteractionPanelComponent(data.npcs_in_room); // Handles people to talk to
-    updateVPadComponent(data); // Update VPad based on new data
+    if (anyChanged(['npcs_in_room'])) updateNPCInteractionPanelComponent(data.npcs_in_room); // Handles people to talk to
+    if (anyChanged(['available_exits', 'available_actions'])) updateVPadComponent(data); // Update VPad based on new data
 
     // Update the Inventory Modal Component (handles opening if action was 'inventory')
     updateInventoryModalComponent(data, actionStringEcho);
 
     // Control visibility of the Save Game button in Command Nexus
+    if (anyChanged(['can_save_in_city'])) updateSaveButtonsComponent(data);
+
+    // --- Conditional Map Display ---
+    if (anyChanged(MAP_FIELDS) || newDeadEndFound) updateMapDisplayComponent(data);
+}
+
+function updateSaveButtonsComponent(data) {
     console.log("[SaveButtonDebug] Checking save button visibility. data.can_save_in_city:", data.can_save_in_city);
     const commandNexusSaveButton = document.getElementById('action-slot-save-button');
     console.log("[SaveButtonDebug] commandNexusSaveButton element:", commandNexusSaveButton);
@@ -1222,9 +1371,9 @@ function displaySceneData(data, actionStringEcho = null) {
             dedicatedSaveButton.style.display = 'none';
         }
     }
+}
 
-
-    // --- Conditional Map Display ---
+function updateMapDisplayComponent(data) {
     const primaryMapDisplayElement = document.getElementById('zone-map-side-panel'); // This is now the single map display area
 
     if (data.map_type === "city" && data.city_map_data) {
@@ -0,0 +1,297 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\storage.py
+# Where character saves are kept. Every backend stores a character under its key (the sanitized character
+# name) as a set of JSON-encoded fields (see save_engine.encode_state), plus the roster entry shown in the
+# character lists (see roster.py). Like the save engine, backends write only the fields that changed.
+#  - FilesystemStorage: player_data/<key>/character_creation.json + journal (save_engine.py), with roster.json.
+#  - SQLiteStorage: one database file in WAL mode, so saves don't block readers; one row per character field.
+#  - MemoryStorage: nothing leaves the process, for tests and benchmarks.
+# Event logs are not saves; they stay in player_data/<key>/events.jsonl whichever backend is used.
+# migrate() copies every character from one backend into another, e.g. existing directories into SQLite.
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import roster
+from save_engine import SNAPSHOT_FILENAME, SaveEngine, encode_state
+
+BACKENDS = ("filesystem", "sqlite", "memory")
+DEFAULT_BACKEND = "filesystem"
+SQLITE_FILENAME = "characters.sqlite3"
+SQLITE_BUSY_TIMEOUT_SECONDS = 30
+
+
+class FilesystemStorage:
+    """One directory per character, holding a snapshot + journal save (see save_engine.py)."""
+
+    name = "filesystem"
+
+    def __init__(self, base_dir, compact_after_entries=None):
+        self.base_dir = base_dir
+        self.engine = SaveEngine() if compact_after_entries is None else SaveEngine(compact_after_entries=compact_after_entries)
+        self.roster = roster.CharacterRoster(base_dir, load_state=self.engine.load)
+
+    def character_dir(self, key):
+        return os.path.join(self.base_dir, key)
+
+    def save(self, key, encoded_fields, roster_entry):
+        """Writes the character's encoded fields. Returns "snapshot", "journal" or "unchanged"."""
+        character_dir = self.character_dir(key)
+        os.makedirs(character_dir, exist_ok=True)
+        save_kind = self.engine.save_encoded(character_dir, encoded_fields)
+        self.roster.update(key, roster_entry)
+        return save_kind
+
+    def load(self, key):
+        return self.engine.load(self.character_dir(key))
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.character_dir(key), SNAPSHOT_FILENAME))
+
+    def delete(self, key):
+        """Removes the character (its whole directory). Returns False if there was nothing to delete."""
+        character_dir = self.character_dir(key)
+        self.roster.remove(key) # Also drops an entry whose directory was removed by hand
+        if not os.path.isdir(character_dir):
+            return False
+        shutil.rmtree(character_dir)
+        self.engine.forget(character_dir)
+        return True
+
+    def characters(self):
+        """[(key, roster entry)] in the order the characters were created. An entry is None if its save is unreadable."""
+        return self.roster.entries()
+
+    def count(self):
+        return len(self.roster)
+
+    def rebuild_index(self):
+        """Rebuilds the roster from the saves. Returns the number of characters."""
+        return self.roster.rebuild()
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage:
+    """All characters in one SQLite database: a row per character (the roster) and a row per saved field."""
+
+    name = "sqlite"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS characters (
+            key TEXT PRIMARY KEY,
+            name TEXT,
+            species_id TEXT,
+            class_id TEXT,
+            level INTEGER,
+            readable INTEGER NOT NULL DEFAULT 1,
+            created_at REAL NOT NULL,
+            saved_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS characters_by_creation ON characters (created_at);
+        CREATE INDEX IF NOT EXISTS characters_by_name ON characters (name COLLATE NOCASE);
+        CREATE TABLE IF NOT EXISTS character_fields (
+            key TEXT NOT NULL,
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (key, field)
+        ) WITHOUT ROWID;
+    """ # WITHOUT ROWID keeps a character's fields together in primary key order, so loading one is a single range scan
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self._saved_fields = {} # key -> {field: encoded value} as last written by this process
+        self._thread_state = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._key_locks = {}
+        with self._connection() as connection:
+            connection.executescript(self.SCHEMA)
+
+    def _connection(self):
+        """This thread's connection. SQLite connections must not be shared between threads without locking."""
+        connection = getattr(self._thread_state, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.database_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.database_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL") # Readers see the last commit while a save is being written
+            connection.execute("PRAGMA synchronous=NORMAL") # With WAL a crash can lose the last commits but never corrupts
+            self._thread_state.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _lock_for(self, key):
+        with self._connections_lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def save(self, key, encoded_fields, roster_entry):
+        """Writes the character's encoded fields. Returns "snapshot" (all fields), "delta" or "unchanged"."""
+        with self._lock_for(key):
+            previous_fields = self._saved_fields.get(key)
+            now = time.time()
+            with self._connection() as connection: # One transaction, committed on success
+                if previous_fields is None:
+                    # Nothing known about what's in the database yet (first save this run): replace every field
+                    connection.execute("DELETE FROM character_fields WHERE key = ?", (key,))
+                    changed = encoded_fields
+                    removed = []
+                else:
+                    changed = {field: encoded for field, encoded in encoded_fields.items() if previous_fields.get(field) != encoded}
+                    removed = [field for field in previous_fields if field not in encoded_fields]
+                    if not changed and not removed:
+                        return "unchanged"
+                connection.executemany("INSERT OR REPLACE INTO character_fields (key, field, value) VALUES (?, ?, ?)",
+                                       [(key, field, encoded) for field, encoded in changed.items()])
+                connection.executemany("DELETE FROM character_fields WHERE key = ? AND field = ?", [(key, field) for field in removed])
+                connection.execute(
+                    "INSERT INTO characters (key, name, species_id, class_id, level, readable, created_at, saved_at) "
+                    "VALUES (?, ?, ?, ?, ?, 1, ?, ?) ON CONFLICT (key) DO UPDATE SET name = excluded.name, "
+                    "species_id = excluded.species_id, class_id = excluded.class_id, level = excluded.level, "
+                    "readable = 1, saved_at = excluded.saved_at",
+                    (key, roster_entry["name"], roster_entry["species_id"], roster_entry["class_id"], roster_entry["level"], now, now))
+            self._saved_fields[key] = encoded_fields
+            return "snapshot" if previous_fields is None else "delta"
+
+    def load(self, key):
+        rows = self._connection().execute("SELECT field, value FROM character_fields WHERE key = ?", (key,)).fetchall()
+        if not rows:
+            return None
+        return {field: json.loads(value) for field, value in rows}
+
+    def exists(self, key):
+        return self._connection().execute("SELECT 1 FROM characters WHERE key = ?", (key,)).fetchone() is not None
+
+    def delete(self, key):
+        with self._lock_for(key):
+            with self._connection() as connection:
+                connection.execute("DELETE FROM character_fields WHERE key = ?", (key,))
+                deleted = connection.execute("DELETE FROM characters WHERE key = ?", (key,)).rowcount
+            self._saved_fields.pop(key, None)
+        return deleted > 0
+
+    def characters(self):
+        rows = self._connection().execute(
+            "SELECT key, name, species_id, class_id, level, readable FROM characters ORDER BY created_at, key").fetchall()
+        return [(key, {"name": name, "species_id": species_id, "class_id": class_id, "level": level} if readable else None)
+                for key, name, species_id, class_id, level, readable in rows]
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM characters").fetchone()[0]
+
+    def rebuild_index(self):
+        """Recomputes every character's roster columns from its saved fields. Returns the number of characters."""
+        connection = self._connection()
+        keys = [row[0] for row in connection.execute("SELECT DISTINCT key FROM character_fields").fetchall()]
+        now = time.time()
+        with connection:
+            connection.execute("DELETE FROM characters WHERE key NOT IN (SELECT DISTINCT key FROM character_fields)")
+            for key in keys:
+                try:
+                    entry, readable = roster.roster_entry(self.load(key)), 1
+                except (ValueError, AttributeError) as e:
+                    print(f"[WARNING] Could not read the save of '{key}' for the roster: {e}")
+                    entry, readable = {"name": None, "species_id": None, "class_id": None, "level": None}, 0
+                connection.execute(
+                    "INSERT INTO characters (key, name, species_id, class_id, level, readable, created_at, saved_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET name = excluded.name, "
+                    "species_id = excluded.species_id, class_id = excluded.class_id, level = excluded.level, "
+                    "readable = excluded.readable",
+                    (key, entry["name"], entry["species_id"], entry["class_id"], entry["level"], readable, now, now))
+        return len(keys)
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._thread_state = threading.local()
+
+
+class MemoryStorage:
+    """Keeps saves in this process only. Everything is lost when it exits."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._fields = {}  # key -> {field: encoded value}
+        self._entries = {} # key -> roster entry, in creation order
+        self._lock = threading.Lock()
+
+    def save(self, key, encoded_fields, roster_entry):
+        with self._lock:
+            previous_fields = self._fields.get(key)
+            self._fields[key] = dict(encoded_fields)
+            self._entries[key] = roster_entry
+        if previous_fields is None:
+            return "snapshot"
+        return "unchanged" if previous_fields == encoded_fields else "delta"
+
+    def load(self, key):
+        fields = self._fields.get(key)
+        if fields is None:
+            return None
+        return {field: json.loads(value) for field, value in fields.items()} # Fresh objects, like reading a file would give
+
+    def exists(self, key):
+        return key in self._fields
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            return self._fields.pop(key, None) is not None
+
+    def characters(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def count(self):
+        return len(self._entries)
+
+    def rebuild_index(self):
+        with self._lock:
+            self._entries = {key: roster.roster_entry(self.load(key)) for key in self._fields}
+            return len(self._entries)
+
+    def close(self):
+        pass
+
+
+def create_storage(backend, player_data_dir, sqlite_path=None, compact_after_entries=None):
+    """The storage backend called backend ("filesystem", "sqlite" or "memory"). Raises ValueError for any other name."""
+    if backend == "filesystem":
+        return FilesystemStorage(player_data_dir, compact_after_entries=compact_after_entries)
+    if backend == "sqlite":
+        return SQLiteStorage(sqlite_path or os.path.join(player_data_dir, SQLITE_FILENAME))
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend '{backend}'. Choose one of: {', '.join(BACKENDS)}.")
+
+
+def migrate(source, target, overwrite=False):
+    """Copies every character from source to target storage. Returns (copied, skipped).
+
+    Characters that already exist in target are skipped unless overwrite is set, so an interrupted
+    migration can simply be run again. Characters whose save can't be read are skipped and reported.
+    """
+    copied = skipped = 0
+    for key, _entry in source.characters():
+        if target.exists(key) and not overwrite:
+            skipped += 1
+            continue
+        try:
+            state = source.load(key)
+        except (OSError, ValueError) as e:
+            print(f"[Migrate] Skipping '{key}': its save can't be read ({e}).")
+            skipped += 1
+            continue
+        if state is None:
+            skipped += 1
+            continue
+        target.save(key, encode_state(state), roster.roster_entry(state))
+        copied += 1
+    return copied, skipped
@@ -0,0 +1,37 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\tests\conftest.py
+# Shared fixtures. The game script's file name ("Adventure of Textland.py") can't be imported by name, so it is
+# loaded from its path once per test run, with a manual game clock and in-memory saves so tests never touch
+# player_data/.
+import importlib.util
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+
+@pytest.fixture(scope="session")
+def game(tmp_path_factory):
+    """The game module, with its player data directory moved to a temp directory."""
+    os.environ["TEXTLAND_CLOCK"] = "manual"
+    os.environ["TEXTLAND_STORAGE"] = "memory"
+    spec = importlib.util.spec_from_file_location("adventure_of_textland", os.path.join(REPO_DIR, "Adventure of Textland.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    module.PLAYER_LOGS_DIR = str(tmp_path_factory.mktemp("player_data"))
+    return module
+
+
+@pytest.fixture
+def web_client(game):
+    """A Flask test client with a fresh game session, playing a newly created character."""
+    pytest.importorskip("flask")
+    client = game.flask_app_instance.test_client()
+    response = client.post("/api/create_character", json={"species_id": "human", "class_id": "warrior",
+                                                           "player_name": "Tester", "player_gender": "Male"})
+    assert response.status_code == 200
+    return client
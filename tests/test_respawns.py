@@ -0,0 +1,26 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\tests\test_respawns.py
+LOCATION_ID = "gloomy_cave_entrance"
+NPC_ID = "cave_lurker"
+
+
+def test_respawn_is_pushed_to_the_browser(game, web_client):
+    token = web_client.get_cookie(game.SESSION_COOKIE_NAME).value
+    web_session = game.web_sessions.get_session(token)
+    events = game.push_hub.stream(token)
+    next(events) # The stream's retry header
+
+    with web_session.lock:
+        game.sessions.bind_session(web_session)
+        try:
+            game.player.move_to(LOCATION_ID)
+            npc_template = game.locations[LOCATION_ID]["npcs"][NPC_ID].template
+            game.player.enter_combat(NPC_ID)
+            game.handle_npc_defeat(NPC_ID)
+        finally:
+            game.sessions.unbind_session()
+    assert NPC_ID not in web_session.world[LOCATION_ID]["npcs"]
+
+    # No request comes in: the game clock event alone brings the NPC back and pushes the scene
+    game.world_clock.advance(game.spawns.respawn_delay(npc_template, game.NPC_RESPAWN_SECONDS))
+    assert f"{npc_template.name} is back." in next(events)
+    assert NPC_ID in web_session.world[LOCATION_ID]["npcs"]
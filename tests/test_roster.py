@@ -0,0 +1,23 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\tests\test_roster.py
+import os
+
+import roster
+from save_engine import SaveEngine
+
+
+def test_first_save_in_fresh_player_data_prints_no_warning(tmp_path, capsys):
+    character_roster = roster.CharacterRoster(str(tmp_path / "player_data"), load_state=SaveEngine().load)
+    assert character_roster.entries() == [] # The character list is shown before the first character exists
+    character_roster.update("Aria", {"name": "Aria", "species_id": "elf", "class_id": "mage", "level": 1})
+
+    assert "[WARNING]" not in capsys.readouterr().out
+    assert character_roster.entries() == [("Aria", {"name": "Aria", "species_id": "elf", "class_id": "mage", "level": 1})]
+
+
+def test_removed_roster_file_is_rebuilt_with_a_warning(tmp_path, capsys):
+    character_roster = roster.CharacterRoster(str(tmp_path), load_state=SaveEngine().load)
+    character_roster.update("Aria", {"name": "Aria", "level": 1})
+    os.remove(os.path.join(str(tmp_path), roster.ROSTER_FILENAME))
+
+    assert character_roster.entries() == [] # No saves on disk to rebuild Aria's entry from
+    assert "was removed" in capsys.readouterr().out
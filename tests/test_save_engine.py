@@ -0,0 +1,50 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\tests\test_save_engine.py
+import builtins
+import errno
+import os
+
+import pytest
+
+import save_engine
+from save_engine import JOURNAL_FILENAME, SaveEngine
+
+
+class TornWriteFile:
+    """A file whose next write only gets half of its data to disk before failing, like a full disk."""
+
+    def __init__(self, file):
+        self._file = file
+
+    def write(self, data):
+        self._file.write(data[:len(data) // 2])
+        self._file.flush()
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+def test_save_after_a_torn_journal_append_is_not_lost(tmp_path, monkeypatch):
+    character_dir = str(tmp_path)
+    engine = SaveEngine()
+    engine.save(character_dir, {"hp": 10, "coins": 0}) # Snapshot
+    engine.save(character_dir, {"hp": 9, "coins": 0})  # Journal
+
+    def torn_open(path, mode="r", *args, **kwargs):
+        real_file = builtins.open(path, mode, *args, **kwargs)
+        return TornWriteFile(real_file) if path.endswith(JOURNAL_FILENAME) and mode.startswith("a") else real_file
+    monkeypatch.setattr(save_engine, "open", torn_open, raising=False)
+    with pytest.raises(OSError):
+        engine.save(character_dir, {"hp": 8, "coins": 0})
+    monkeypatch.undo()
+
+    assert engine.save(character_dir, {"hp": 7, "coins": 25}) in ("journal", "snapshot")
+    assert SaveEngine().load(character_dir) == {"hp": 7, "coins": 25}
+    with open(os.path.join(character_dir, JOURNAL_FILENAME), "r", encoding="utf-8") as f:
+        assert all(line.endswith("}\n") for line in f) # No torn line left behind
@@ -0,0 +1,19 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\tests\test_web_actions.py
+import pytest
+
+
+@pytest.mark.parametrize("failing_action", ["use_item nonexistent", "talk nobody", "examine nothing_here",
+                                            "set_player_preference no_such_pref true"])
+def test_batch_stops_at_failed_action(web_client, failing_action):
+    response = web_client.post("/process_game_actions", json={"actions": [failing_action, "inventory"]})
+    data = response.get_json()
+    assert data["stop_reason"] == "failed"
+    assert [result["action"] for result in data["action_results"]] == [failing_action]
+    assert data["action_results"][0]["ok"] is False
+
+
+def test_batch_runs_every_successful_action(web_client):
+    response = web_client.post("/process_game_actions", json={"actions": ["look", "inventory"]})
+    data = response.get_json()
+    assert data["stop_reason"] is None
+    assert all(result["ok"] for result in data["action_results"])
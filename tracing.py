@@ -0,0 +1,146 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\tracing.py
+# Low-overhead function tracing (the "steptracker").
+# Functions decorated with @traced record their call count, total/max duration (in nanoseconds) and
+# call nesting depth while tracing is enabled. Individual calls go into an in-memory ring buffer that
+# a background thread appends to the trace log in batches.
+# Tracing can be switched on and off at any time; while it is off a traced call costs one flag check.
+import atexit
+import functools
+import os
+import threading
+import time
+from collections import deque
+
+DEFAULT_RING_BUFFER_SIZE = 10000 # Calls not yet flushed to the log; the oldest are dropped beyond this
+DEFAULT_FLUSH_INTERVAL_SECONDS = 2.0
+
+
+class FunctionStats:
+    __slots__ = ("calls", "total_ns", "max_ns", "max_depth")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.max_depth = 0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "total_ns": self.total_ns,
+            "avg_ns": self.total_ns // self.calls if self.calls else 0,
+            "max_ns": self.max_ns,
+            "max_depth": self.max_depth
+        }
+
+
+class Tracer:
+    def __init__(self, log_file=None, ring_buffer_size=DEFAULT_RING_BUFFER_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL_SECONDS):
+        self.enabled = False
+        self.log_file = log_file # None keeps traces in memory only
+        self.flush_interval = flush_interval
+        self.stats = {}          # function name -> FunctionStats
+        self.dropped_calls = 0   # Calls that fell out of the ring buffer before they were flushed
+        self._ring = deque(maxlen=ring_buffer_size) # (wall time ns, function name, depth, duration ns, thread name)
+        self._lock = threading.Lock()
+        self._depth = threading.local()
+        self._flush_thread = None
+        self._stop = threading.Event()
+
+    # --- Switching on and off ---
+    def enable(self):
+        self.enabled = True
+        self._ensure_flush_thread()
+
+    def disable(self):
+        self.enabled = False
+        self.flush()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+            self.dropped_calls = 0
+
+    # --- Recording ---
+    def traced(self, func):
+        """Decorator that records calls to func while tracing is enabled."""
+        func_name = func.__name__
+
+        @functools.wraps(func) # Preserves original function metadata (Flask endpoint names rely on it)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            return self.call(func_name, func, *args, **kwargs)
+        return wrapper
+
+    def call(self, name, func, *args, **kwargs):
+        """Calls func and records it under name (for code that isn't a decorated function, e.g. command handlers)."""
+        if not self.enabled:
+            return func(*args, **kwargs)
+        depth = getattr(self._depth, "value", 0) + 1
+        self._depth.value = depth
+        start_ns = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration_ns = time.perf_counter_ns() - start_ns
+            self._depth.value = depth - 1
+            self._record(name, depth, duration_ns)
+
+    def _record(self, func_name, depth, duration_ns):
+        with self._lock:
+            stats = self.stats.get(func_name)
+            if stats is None:
+                stats = self.stats[func_name] = FunctionStats()
+            stats.calls += 1
+            stats.total_ns += duration_ns
+            if duration_ns > stats.max_ns:
+                stats.max_ns = duration_ns
+            if depth > stats.max_depth:
+                stats.max_depth = depth
+            if len(self._ring) == self._ring.maxlen:
+                self.dropped_calls += 1
+            self._ring.append((time.time_ns(), func_name, depth, duration_ns, threading.current_thread().name))
+
+    # --- Reporting ---
+    def snapshot(self):
+        """Returns {"enabled", "dropped_calls", "functions": {name: stats dict}} for reports and metrics."""
+        with self._lock:
+            functions = {name: stats.as_dict() for name, stats in self.stats.items()}
+            dropped_calls = self.dropped_calls
+        return {"enabled": self.enabled, "dropped_calls": dropped_calls, "functions": functions}
+
+    def flush(self):
+        """Appends every buffered call to the trace log in one write."""
+        with self._lock:
+            calls = list(self._ring)
+            self._ring.clear()
+        if not calls or not self.log_file:
+            return
+        lines = []
+        for wall_ns, func_name, depth, duration_ns, thread_name in calls:
+            seconds, nanos = divmod(wall_ns, 1_000_000_000)
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(seconds))
+            lines.append(f"{timestamp}.{nanos:09d} - Function called: {func_name} "
+                         f"(depth {depth}, {duration_ns} ns, thread {thread_name})\n")
+        try:
+            os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+        except OSError as e:
+            print(f"[ERROR] Failed to write to steptracker log: {e}")
+
+    def _ensure_flush_thread(self):
+        with self._lock:
+            if self._flush_thread is None:
+                self._flush_thread = threading.Thread(target=self._run, name="TraceFlusher", daemon=True)
+                self._flush_thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+tracer = Tracer()
+traced = tracer.traced
+atexit.register(tracer.flush)
@@ -0,0 +1,179 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\world_bundle.py
+# Precompiled world bundle.
+# Parsing every JSON file under data/, instantiating environmental features and building NPC objects
+# is done once and the result is stored as versioned, checksummed pickle files:
+#   index.pickle      - items, species, classes, layouts, the location -> zone index and lightweight map stubs
+#   zones/<zone>.pickle - one shard per zone with its locations (features, NPCs) and city maps
+# Zone shards are only read when a player first enters the zone (see zone_store.py).
+# The index records the size and modification time of every source file it was built from,
+# so editing anything under data/ makes the bundle stale and it is rebuilt automatically on the next load.
+import hashlib
+import os
+import pickle
+import re
+import struct
+
+BUNDLE_MAGIC = b"TXLBNDL2"
+BUNDLE_FORMAT_VERSION = 4 # Bump whenever the structure of the compiled game data changes
+INDEX_FILENAME = "index.pickle"
+ZONES_DIRNAME = "zones"
+UNZONED_ZONE = "Uncharted Territories" # Zone used for locations that don't declare one
+# Heavy per-location sections that live only in the zone shards; everything else is copied into the map stubs
+SHARD_ONLY_LOCATION_KEYS = ("npcs", "features", "items")
+_HEADER = struct.Struct(">8sI32s") # magic, format version, sha256 of the payload
+
+
+def compute_source_fingerprint(data_dir):
+    """Returns a sorted list of (relative path, size, mtime_ns) for every JSON source file under data_dir."""
+    fingerprint = []
+    for root, _dirs, files in os.walk(data_dir):
+        for filename in files:
+            if not filename.endswith(".json"):
+                continue
+            filepath = os.path.join(root, filename)
+            try:
+                stat_result = os.stat(filepath)
+            except OSError:
+                continue
+            rel_path = os.path.relpath(filepath, data_dir).replace(os.sep, "/")
+            fingerprint.append((rel_path, stat_result.st_size, stat_result.st_mtime_ns))
+    fingerprint.sort()
+    return fingerprint
+
+
+def partition_game_data(game_data, source_fingerprint=None):
+    """Splits compiled game data into (index, {zone: shard}) without touching the disk."""
+    locations = game_data["locations"]
+    location_zones = {loc_id: loc_data.get("zone") or UNZONED_ZONE for loc_id, loc_data in locations.items()}
+
+    # A city map belongs to the zone of the location that leads into it
+    city_zones = {}
+    for loc_id, loc_data in locations.items():
+        city_id = loc_data.get("city_map_transitions", {}).get("enter", {}).get("city_id")
+        if city_id and city_id in game_data["city_maps"]:
+            city_zones.setdefault(city_id, location_zones[loc_id])
+
+    shards = {}
+    for loc_id, zone in location_zones.items():
+        shards.setdefault(zone, {"locations": {}, "city_maps": {}})["locations"][loc_id] = locations[loc_id]
+    for city_id, zone in city_zones.items():
+        shards[zone]["city_maps"][city_id] = game_data["city_maps"][city_id]
+
+    location_stubs = {}
+    for loc_id, loc_data in locations.items():
+        stub = {k: v for k, v in loc_data.items() if k not in SHARD_ONLY_LOCATION_KEYS}
+        stub["zone"] = location_zones[loc_id]
+        location_stubs[loc_id] = stub
+
+    index = {
+        "fingerprint": source_fingerprint,
+        "shared": {k: v for k, v in game_data.items() if k not in ("locations", "city_maps")},
+        "location_zones": location_zones,
+        "city_zones": city_zones,
+        "location_stubs": location_stubs,
+        "zones": {zone: {"location_ids": sorted(shard["locations"])} for zone, shard in shards.items()}
+    }
+    return index, shards
+
+
+def write_bundle(bundle_dir, game_data, source_fingerprint):
+    """Writes the compiled game data as an index plus one shard per zone. Returns the index, or None on failure."""
+    index, shards = partition_game_data(game_data, source_fingerprint)
+    zones_dir = os.path.join(bundle_dir, ZONES_DIRNAME)
+    try:
+        os.makedirs(zones_dir, exist_ok=True)
+        written_files = set()
+        for zone, shard in shards.items():
+            payload = pickle.dumps(shard, protocol=pickle.HIGHEST_PROTOCOL)
+            checksum = hashlib.sha256(payload).digest()
+            # Content-addressed names: a reader holding an older index never picks up a newer shard by mistake
+            shard_filename = f"{_safe_zone_filename(zone)}-{checksum.hex()[:12]}.pickle"
+            _write_checksummed_file(os.path.join(zones_dir, shard_filename), payload, checksum)
+            index["zones"][zone].update({"file": shard_filename, "size": len(payload)})
+            written_files.add(shard_filename)
+
+        index_payload = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+        _write_checksummed_file(os.path.join(bundle_dir, INDEX_FILENAME), index_payload)
+
+        for filename in os.listdir(zones_dir): # Drop shards from previous builds
+            if filename.endswith(".pickle") and filename not in written_files:
+                try:
+                    os.remove(os.path.join(zones_dir, filename))
+                except OSError:
+                    pass
+    except OSError as e:
+        print(f"[WARNING] Could not write world bundle to {bundle_dir}: {e}")
+        return None
+    return index
+
+
+def load_bundle_index(bundle_dir, data_dir):
+    """Returns the bundle index, or None if it is missing, corrupt, outdated or stale."""
+    index_path = os.path.join(bundle_dir, INDEX_FILENAME)
+    index = _read_checksummed_file(index_path)
+    if index is None:
+        return None
+    if index.get("fingerprint") != compute_source_fingerprint(data_dir):
+        return None # Some file under data/ was added, removed or edited since the bundle was built
+    for zone_entry in index.get("zones", {}).values():
+        if not os.path.exists(os.path.join(bundle_dir, ZONES_DIRNAME, zone_entry.get("file", ""))):
+            print(f"[WARNING] World bundle in {bundle_dir} is missing zone shards. It will be rebuilt.")
+            return None
+    return index
+
+
+def load_zone_shard(bundle_dir, index, zone):
+    """Reads one zone shard ({"locations": ..., "city_maps": ...}) from disk, or None on failure."""
+    shard_path = zone_shard_path(bundle_dir, index, zone)
+    if shard_path is None:
+        return None
+    return _read_checksummed_file(shard_path)
+
+
+def zone_shard_path(bundle_dir, index, zone):
+    """Path of a zone's shard file, or None if the index has no such zone."""
+    zone_entry = index["zones"].get(zone)
+    if not zone_entry:
+        return None
+    return os.path.join(bundle_dir, ZONES_DIRNAME, zone_entry["file"])
+
+
+def _safe_zone_filename(zone):
+    return re.sub(r"[^-\w]", "_", zone) or "zone"
+
+
+def _write_checksummed_file(filepath, payload, checksum=None):
+    header = _HEADER.pack(BUNDLE_MAGIC, BUNDLE_FORMAT_VERSION, checksum or hashlib.sha256(payload).digest())
+    temp_path = f"{filepath}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(temp_path, filepath)
+
+
+def _read_checksummed_file(filepath):
+    try:
+        with open(filepath, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        print(f"[WARNING] Could not read world bundle file {filepath}: {e}")
+        return None
+
+    if len(raw) < _HEADER.size:
+        print(f"[WARNING] World bundle file {filepath} is truncated. It will be rebuilt.")
+        return None
+    magic, format_version, checksum = _HEADER.unpack_from(raw)
+    if magic != BUNDLE_MAGIC or format_version != BUNDLE_FORMAT_VERSION:
+        print(f"[Game Data] World bundle format changed (v{format_version}, expected v{BUNDLE_FORMAT_VERSION}). Rebuilding.")
+        return None
+    payload = raw[_HEADER.size:]
+    if hashlib.sha256(payload).digest() != checksum:
+        print(f"[WARNING] World bundle file {filepath} failed its checksum. It will be rebuilt.")
+        return None
+    try:
+        return pickle.loads(payload)
+    except Exception as e: # pylint: disable=broad-except
+        print(f"[WARNING] Could not unpack world bundle file {filepath}: {e}. It will be rebuilt.")
+        return None
@@ -0,0 +1,67 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\world_map.py
+# Precomputed world map records for the browser's zone map (get_world_map_data_for_api).
+# Everything shown for a location the player hasn't visited is map-level data shared by all players, so
+# those records are built once per data load from the location stubs. A visited location also shows
+# details from its zone (description, features, NPCs); that record is built the first time any player
+# visits it and then shared. Only locations a player has changed (e.g. defeated an NPC there) get a
+# record of their own. Records are shared between players and responses and must not be modified.
+
+
+def build_location_record(loc_id, loc_data, visited):
+    """The map entry for one location, with the tooltip details a visitor has discovered."""
+    return {
+        # Basic location info
+        "id": loc_id,
+        "name": loc_data.get("name", loc_id),
+        "x": loc_data["map_x"],
+        "y": loc_data["map_y"],
+        "visited": visited,
+        "exits": loc_data.get("exits", {}),
+        # Enhanced tooltip with additional information
+        "tooltip": {
+            # Basic tooltip info
+            "name": loc_data.get("name", loc_id),
+            "description": loc_data.get("description", "An unknown area.") if visited else "You haven't visited this location yet.",
+            "zone": loc_data.get("zone", "Unknown Zone"),
+            "exits": list(loc_data.get("exits", {}).keys()) if visited else [],
+            "discovered": visited,
+            # Additional info for location details
+            "features": [f.replace("_", " ").title() for f in loc_data.get("features", {})] if visited else [],
+            "npcs": [npc.name for npc in loc_data.get("npcs", {}).values()] if visited else [],
+            "terrain": loc_data.get("terrain", "Unknown"),
+            "danger_level": loc_data.get("danger_level", "Unknown") if visited else "???",
+            "points_of_interest": loc_data.get("points_of_interest", []) if visited else [],
+            # Additional environmental details
+            "ambient": loc_data.get("ambient_text", ""),
+            "environment_type": loc_data.get("environment_type", "Standard"),
+            "recommended_level": loc_data.get("recommended_level", "Any")
+        }
+    }
+
+
+class WorldMapIndex:
+    def __init__(self, base_locations):
+        self.base = base_locations
+        self.location_ids = [] # Locations with map coordinates, in world order
+        self._unvisited_records = {}
+        self._visited_records = {} # Built from the shared world on first visit, since they need the zone loaded
+        for loc_id, loc_stub in base_locations.location_stubs().items():
+            if "map_x" in loc_stub and "map_y" in loc_stub:
+                self.location_ids.append(loc_id)
+                self._unvisited_records[loc_id] = build_location_record(loc_id, loc_stub, visited=False)
+
+    def record(self, loc_id, visited, world):
+        if not visited:
+            return self._unvisited_records[loc_id]
+        if world.has_changes(loc_id):
+            return build_location_record(loc_id, world[loc_id], visited=True) # This player's own view of it
+        record = self._visited_records.get(loc_id)
+        if record is None:
+            # Two sessions may build it at the same time; both records are identical, so either one can win
+            record = build_location_record(loc_id, self.base[loc_id], visited=True)
+            self._visited_records[loc_id] = record
+        return record
+
+    def map_locations(self, visited_locations, world):
+        """Every mapped location as seen by a player who visited visited_locations."""
+        return [self.record(loc_id, loc_id in visited_locations, world) for loc_id in self.location_ids]
@@ -0,0 +1,198 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\world_state.py
+# Copy-on-write world state.
+# The locations loaded from data/ are shared by every session and never modified after loading.
+# Each player gets a WorldState that records only what they changed (defeated NPCs, taken/dropped
+# items, opened or harvested features), so memory per player grows with their changes, not the world size.
+# Defeated NPCs come back once their respawn delay has passed (see spawns.py). Reads bring back any that are
+# due, and the game can also schedule respawn_due_npcs() as an event at the time remove_npc() returns.
+import time
+
+import spawns
+
+_REMOVED = object() # Marks a feature field that the player's actions removed (e.g. a key item taken out)
+
+
+class WorldState:
+    """A player's view of the world: the shared base locations plus this player's changes to them.
+
+    Reads work like the old `locations` dict (``world[loc_id]``, ``.get()``, ``.items()``...).
+    Locations the player hasn't changed are returned as-is from the shared base and must be treated
+    as read-only; every change has to go through the methods below.
+    """
+
+    def __init__(self, base_locations, clock=time.monotonic):
+        self.base = base_locations
+        self.respawns = spawns.RespawnScheduler(clock) # Defeated NPCs waiting to come back
+        self.removed_npcs = {}      # loc_id -> set of NPC ids defeated/removed by this player
+        self.npc_overrides = {}     # loc_id -> {npc_id: NPC} private copies of NPCs this player changed (e.g. damaged)
+        self.room_items = {}        # loc_id -> list of item ids, replaces the base list once the player changes it
+        self.feature_overrides = {} # loc_id -> {feature_id: {field: value}} e.g. closed, last_harvested
+        self._merged = {}           # loc_id -> cached merged location dict, only for changed locations
+        self.dirty_locations = set() # loc_ids changed since the web scene cache last looked (see scene.py)
+
+    # --- Read access (dict-like) ---
+    def __getitem__(self, loc_id):
+        if self.respawns:
+            self.respawn_due_npcs()
+        merged = self._merged.get(loc_id)
+        if merged is not None:
+            return merged
+        if loc_id in self.removed_npcs or loc_id in self.npc_overrides or \
+           loc_id in self.room_items or loc_id in self.feature_overrides:
+            merged = self._build_merged_location(loc_id)
+            self._merged[loc_id] = merged
+            return merged
+        return self.base[loc_id]
+
+    def get(self, loc_id, default=None):
+        if loc_id in self.base:
+            return self[loc_id]
+        return default
+
+    def __contains__(self, loc_id):
+        return loc_id in self.base
+
+    def __iter__(self):
+        return iter(self.base)
+
+    def __len__(self):
+        return len(self.base)
+
+    def keys(self):
+        return self.base.keys()
+
+    def items(self):
+        for loc_id in self.base:
+            yield loc_id, self[loc_id]
+
+    def values(self):
+        for loc_id in self.base:
+            yield self[loc_id]
+
+    def location_stubs(self):
+        """Map-level data (name, zone, position, exits...) for every location, without loading any zone."""
+        return self.base.location_stubs()
+
+    def has_changes(self, loc_id=None):
+        """True if the player changed the given location (or anything, if no location is given)."""
+        if loc_id is None:
+            return bool(self.removed_npcs or self.npc_overrides or self.room_items or self.feature_overrides)
+        return loc_id in self.removed_npcs or loc_id in self.npc_overrides or \
+               loc_id in self.room_items or loc_id in self.feature_overrides
+
+    def pop_dirty_locations(self):
+        """Returns the ids of locations changed since the last call, and clears them."""
+        dirty, self.dirty_locations = self.dirty_locations, set()
+        return dirty
+
+    # --- Changes ---
+    def add_room_item(self, loc_id, item_id):
+        self._own_room_items(loc_id).append(item_id)
+        self._invalidate(loc_id)
+
+    def remove_room_item(self, loc_id, item_id):
+        """Removes one instance of an item from the room. Returns False if it wasn't there."""
+        current_items = self.room_items.get(loc_id)
+        if current_items is None:
+            if item_id not in self.base.get(loc_id, {}).get("items", []):
+                return False
+            current_items = self._own_room_items(loc_id)
+        if item_id not in current_items:
+            return False
+        current_items.remove(item_id)
+        self._invalidate(loc_id)
+        return True
+
+    def remove_npc(self, loc_id, npc_id, respawn_after=None):
+        """Removes an NPC (e.g. defeated) from this player's world; with respawn_after (seconds) it comes back then.
+
+        Returns the clock time the NPC respawns at, or None if it doesn't.
+        """
+        self.removed_npcs.setdefault(loc_id, set()).add(npc_id)
+        self.npc_overrides.get(loc_id, {}).pop(npc_id, None)
+        respawn_time = None
+        if respawn_after is not None:
+            respawn_time = self.respawns.schedule(loc_id, npc_id, respawn_after)
+        else:
+            self.respawns.cancel(loc_id, npc_id)
+        self._invalidate(loc_id)
+        return respawn_time
+
+    def respawn_due_npcs(self):
+        """Brings back the removed NPCs whose respawn time has come. Returns [(loc_id, npc_id)] of those."""
+        respawned = self.respawns.pop_due()
+        for loc_id, npc_id in respawned:
+            removed = self.removed_npcs.get(loc_id)
+            if removed is not None:
+                removed.discard(npc_id)
+                if not removed:
+                    del self.removed_npcs[loc_id]
+            # The base world's instance was never changed, so it is a fresh spawn of the template
+            self._invalidate(loc_id)
+        return respawned
+
+    def npc_for_update(self, loc_id, npc_id):
+        """Returns this player's private copy of an NPC so it can be changed (HP, stock) without touching the base world."""
+        overrides = self.npc_overrides.get(loc_id, {})
+        if npc_id in overrides:
+            return overrides[npc_id]
+        if npc_id in self.removed_npcs.get(loc_id, ()):
+            return None
+        base_npc = self.base.get(loc_id, {}).get("npcs", {}).get(npc_id)
+        if base_npc is None:
+            return None
+        npc_copy = base_npc.copy() # Shares the template; only HP and stock are the player's own
+        self.npc_overrides.setdefault(loc_id, {})[npc_id] = npc_copy
+        self._invalidate(loc_id)
+        return npc_copy
+
+    def set_feature_state(self, loc_id, feature_id, **fields):
+        """Overrides fields of a feature for this player only, e.g. closed=False or last_harvested=time.time()."""
+        self.feature_overrides.setdefault(loc_id, {}).setdefault(feature_id, {}).update(fields)
+        self._invalidate(loc_id)
+
+    def pop_feature_field(self, loc_id, feature_id, field_name, default=None):
+        """Removes a field from a feature for this player only and returns its previous value."""
+        feature = self[loc_id].get("features", {}).get(feature_id, {})
+        value = feature.get(field_name, default)
+        self.set_feature_state(loc_id, feature_id, **{field_name: _REMOVED})
+        return value
+
+    # --- Internals ---
+    def _own_room_items(self, loc_id):
+        if loc_id not in self.room_items:
+            self.room_items[loc_id] = list(self.base.get(loc_id, {}).get("items", []))
+        return self.room_items[loc_id]
+
+    def _invalidate(self, loc_id):
+        self._merged.pop(loc_id, None)
+        self.dirty_locations.add(loc_id)
+
+    def _build_merged_location(self, loc_id):
+        base_location = self.base[loc_id]
+        merged = dict(base_location) # Shallow copy; only the sections the player changed are replaced
+
+        if loc_id in self.room_items:
+            merged["items"] = self.room_items[loc_id]
+
+        if loc_id in self.removed_npcs or loc_id in self.npc_overrides:
+            removed = self.removed_npcs.get(loc_id, ())
+            overrides = self.npc_overrides.get(loc_id, {})
+            merged["npcs"] = {
+                npc_id: overrides.get(npc_id, npc_obj)
+                for npc_id, npc_obj in base_location.get("npcs", {}).items()
+                if npc_id not in removed
+            }
+
+        if loc_id in self.feature_overrides:
+            merged_features = dict(base_location.get("features", {}))
+            for feature_id, fields in self.feature_overrides[loc_id].items():
+                feature = dict(merged_features.get(feature_id, {}))
+                for field_name, value in fields.items():
+                    if value is _REMOVED:
+                        feature.pop(field_name, None)
+                    else:
+                        feature[field_name] = value
+                merged_features[feature_id] = feature
+            merged["features"] = merged_features
+        return merged
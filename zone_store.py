@@ -0,0 +1,137 @@
+# d:\GeneralRepository\PythonProjects\AdventureOfTextland\zone_store.py
+# Lazily loaded, zone-partitioned world.
+# Only the small bundle index (location -> zone, map stubs) is resident all the time.
+# A zone's locations, NPCs, features and city maps are loaded the first time something in the zone
+# is accessed, and the least recently used zones are evicted once the memory budget is exceeded.
+# A zone that can't be loaded raises an error naming its shard file rather than looking empty.
+import threading
+from collections import OrderedDict
+
+DEFAULT_ZONE_MEMORY_BUDGET_BYTES = 32 * 1024 * 1024 # Measured as the pickled size of the resident zone shards
+
+
+class ZoneStore:
+    """Read-only mapping of location id -> location data that loads zone shards on demand."""
+
+    def __init__(self, index, shard_loader, memory_budget_bytes=DEFAULT_ZONE_MEMORY_BUDGET_BYTES, shard_path=None):
+        self.index = index
+        self.shard_loader = shard_loader # shard_loader(zone) -> {"locations": {...}, "city_maps": {...}} or None
+        self.shard_path = shard_path     # shard_path(zone) -> file the shard is loaded from; None if shards are in memory
+        self.memory_budget_bytes = memory_budget_bytes
+        self.location_zones = index["location_zones"]
+        self.city_zones = index["city_zones"]
+        self.city_maps = CityMapView(self)
+        self._resident = OrderedDict() # zone -> shard, least recently used first
+        self._resident_bytes = 0
+        self._lock = threading.RLock()
+
+    # --- Mapping over location ids ---
+    def __getitem__(self, loc_id):
+        zone = self.location_zones[loc_id] # KeyError for unknown locations, like a dict
+        return self.load_zone(zone)["locations"][loc_id]
+
+    def get(self, loc_id, default=None):
+        if loc_id in self.location_zones:
+            return self[loc_id]
+        return default
+
+    def __contains__(self, loc_id):
+        return loc_id in self.location_zones
+
+    def __iter__(self):
+        return iter(self.location_zones)
+
+    def __len__(self):
+        return len(self.location_zones)
+
+    def keys(self):
+        return self.location_zones.keys()
+
+    def items(self):
+        """Yields every location. This loads every zone, so hot paths should use location_stubs() instead."""
+        for loc_id in self.location_zones:
+            yield loc_id, self[loc_id]
+
+    def values(self):
+        for loc_id in self.location_zones:
+            yield self[loc_id]
+
+    # --- Zone access ---
+    def location_stubs(self):
+        """Lightweight data for every location (name, zone, map position, exits...) without NPCs, features or items."""
+        return self.index["location_stubs"]
+
+    def zone_of(self, loc_id):
+        return self.location_zones.get(loc_id)
+
+    def resident_zones(self):
+        with self._lock:
+            return list(self._resident)
+
+    def load_zone(self, zone):
+        with self._lock:
+            shard = self._resident.get(zone)
+            if shard is not None:
+                self._resident.move_to_end(zone)
+                return shard
+            shard = self.shard_loader(zone)
+            if shard is None:
+                # Not cached, so the next access tries again (e.g. after the bundle was rebuilt)
+                raise RuntimeError(self._load_failure_message(zone))
+            self._resident[zone] = shard
+            self._resident_bytes += self._zone_size(zone)
+            self._evict_over_budget(keep_zone=zone)
+            return shard
+
+    def evict_zone(self, zone):
+        with self._lock:
+            if self._resident.pop(zone, None) is not None:
+                self._resident_bytes -= self._zone_size(zone)
+                return True
+            return False
+
+    def _evict_over_budget(self, keep_zone):
+        # Evicted zones are simply reloaded from disk on next access; per-player changes live in WorldState
+        while self._resident_bytes > self.memory_budget_bytes and len(self._resident) > 1:
+            oldest_zone = next(iter(self._resident))
+            if oldest_zone == keep_zone:
+                break
+            self.evict_zone(oldest_zone)
+
+    def _load_failure_message(self, zone):
+        shard_file = self.shard_path(zone) if self.shard_path else None
+        if shard_file is None:
+            return f"Zone '{zone}' could not be loaded: it is not part of the loaded world data."
+        return (f"Zone '{zone}' could not be loaded from its world bundle shard {shard_file}. "
+                f"Rebuild the bundle with --build-world-bundle.")
+
+    def _zone_size(self, zone):
+        return self.index["zones"].get(zone, {}).get("size", 0)
+
+
+class CityMapView:
+    """Read-only mapping of city id -> city map, backed by the zone shard the city belongs to."""
+
+    def __init__(self, zone_store):
+        self.zone_store = zone_store
+
+    def __getitem__(self, city_id):
+        zone = self.zone_store.city_zones[city_id]
+        return self.zone_store.load_zone(zone)["city_maps"][city_id]
+
+    def get(self, city_id, default=None):
+        if city_id in self.zone_store.city_zones:
+            return self[city_id]
+        return default
+
+    def __contains__(self, city_id):
+        return city_id in self.zone_store.city_zones
+
+    def __iter__(self):
+        return iter(self.zone_store.city_zones)
+
+    def __len__(self):
+        return len(self.zone_store.city_zones)
+
+    def keys(self):
+        return self.zone_store.city_zones.keys()